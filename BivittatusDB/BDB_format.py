@@ -0,0 +1,322 @@
+#Binary on-disk format for .pydb tables. Replaces the old hexlify(gzip(json)) records
+#written by the shared library. A table file is laid out as:
+#   header | metadata (schema) block | data block
+#Both blocks are zlib compressed. The data block is stored by column with typed arrays
+#so it can be read back without any json or hex decoding.
+
+import metaclass
+try:
+    import struct
+    import zlib
+    from itertools import accumulate
+    from binascii import unhexlify
+    from gzip import decompress
+    from json import loads
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+MAGIC = b"BDBT"
+VERSION = 1
+# magic, version, flags, metadata block length, data block length
+HEADER = struct.Struct("<4sBBxxQQ")
+FLAG_COMPRESSED = 0x01
+
+# tags for single values (metadata and the generic data layout)
+_NONE, _TRUE, _FALSE, _INT, _BIGINT, _FLOAT, _STR, _BYTES, _LIST, _DICT = range(10)
+# column layouts for the typed data block
+_COL_ANY, _COL_INT, _COL_FLOAT, _COL_STR, _COL_BOOL = range(5)
+# layouts for the whole data block
+_LAYOUT_COLUMNS, _LAYOUT_ROWS = range(2)
+
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+_INT_MIN, _INT_MAX = -(1 << 63), (1 << 63) - 1
+
+# legacy records: 256 byte name buffer, 8 byte payload length, hex payload
+_LEGACY_NAME = 256
+_LEGACY_SIZE = struct.Struct("<Q")
+
+def is_current(raw: bytes) -> bool:
+    """Check if raw file contents are already in the binary table format."""
+    return raw[:len(MAGIC)] == MAGIC
+
+# ---------- single values ----------
+def _encode_value(value, out: bytearray):
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        if _INT_MIN <= value <= _INT_MAX:
+            out.append(_INT)
+            out += _I64.pack(value)
+        else:
+            text = str(value).encode()
+            out.append(_BIGINT)
+            out += _U32.pack(len(text)) + text
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    elif isinstance(value, str):
+        text = value.encode()
+        out.append(_STR)
+        out += _U32.pack(len(text)) + text
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        out += _U32.pack(len(value)) + value
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        out += _U32.pack(len(value))
+        for item in value:
+            _encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        out += _U32.pack(len(value))
+        for key, item in value.items():
+            _encode_value(key, out)
+            _encode_value(item, out)
+    else:
+        raise metaclass.BDBException.TypeError(f"Can't store value of type {type(value).__name__}")
+
+def _decode_value(buf, pos: int):
+    tag = buf[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == _FLOAT:
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag in (_STR, _BIGINT, _BYTES):
+        size = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        chunk = bytes(buf[pos:pos + size])
+        if tag == _STR:
+            return chunk.decode(), pos + size
+        if tag == _BIGINT:
+            return int(chunk), pos + size
+        return chunk, pos + size
+    if tag == _LIST:
+        size = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(size):
+            item, pos = _decode_value(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == _DICT:
+        size = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        items = {}
+        for _ in range(size):
+            key, pos = _decode_value(buf, pos)
+            items[key], pos = _decode_value(buf, pos)
+        return items, pos
+    raise metaclass.BDBException.ReadError(f"Unknown value tag {tag} in table file")
+
+# ---------- typed columns ----------
+def _column_kind(values: list) -> int:
+    '''pick the tightest layout that can hold every non-null value of a column'''
+    kinds = {type(value) for value in values if value is not None}
+    if kinds == {int}:
+        if all(_INT_MIN <= value <= _INT_MAX for value in values if value is not None):
+            return _COL_INT
+    elif kinds == {float}:
+        return _COL_FLOAT
+    elif kinds == {str}:
+        return _COL_STR
+    elif kinds == {bool}:
+        return _COL_BOOL
+    return _COL_ANY
+
+def _encode_column(values: list, out: bytearray):
+    kind = _column_kind(values)
+    out.append(kind)
+    if kind == _COL_ANY:
+        for value in values:
+            _encode_value(value, out)
+        return
+    nulls = bytes(value is None for value in values)
+    if any(nulls):
+        out.append(1)
+        out += nulls
+    else:
+        out.append(0)
+    count = len(values)
+    if kind == _COL_INT:
+        out += struct.pack(f"<{count}q", *(0 if value is None else value for value in values))
+    elif kind == _COL_FLOAT:
+        out += struct.pack(f"<{count}d", *(0.0 if value is None else value for value in values))
+    elif kind == _COL_BOOL:
+        out += bytes(bool(value) for value in values)
+    else:
+        encoded = [b"" if value is None else value.encode() for value in values]
+        out += struct.pack(f"<{count}I", *map(len, encoded))
+        out += b"".join(encoded)
+
+def _decode_column(buf, pos: int, count: int):
+    kind = buf[pos]
+    pos += 1
+    if kind == _COL_ANY:
+        values = []
+        for _ in range(count):
+            value, pos = _decode_value(buf, pos)
+            values.append(value)
+        return values, pos
+    nulls = None
+    if buf[pos]:
+        nulls = bytes(buf[pos + 1:pos + 1 + count])
+        pos += count
+    pos += 1
+    if kind == _COL_INT:
+        values = list(struct.unpack_from(f"<{count}q", buf, pos))
+        pos += 8 * count
+    elif kind == _COL_FLOAT:
+        values = list(struct.unpack_from(f"<{count}d", buf, pos))
+        pos += 8 * count
+    elif kind == _COL_BOOL:
+        values = [flag == 1 for flag in buf[pos:pos + count]]
+        pos += count
+    elif kind == _COL_STR:
+        ends = list(accumulate(struct.unpack_from(f"<{count}I", buf, pos)))
+        pos += 4 * count
+        blob = bytes(buf[pos:pos + (ends[-1] if ends else 0)])
+        pos += len(blob)
+        text = blob.decode()
+        if len(text) != len(blob):
+            # multi-byte characters, offsets are only valid on the bytes
+            values = [blob[start:end].decode() for start, end in zip([0] + ends, ends)]
+        else:
+            values = [text[start:end] for start, end in zip([0] + ends, ends)]
+    else:
+        raise metaclass.BDBException.ReadError(f"Unknown column layout {kind} in table file")
+    if nulls:
+        values = [None if null else value for value, null in zip(values, nulls)]
+    return values, pos
+
+# ---------- blocks ----------
+def encode_value(value) -> bytes:
+    """Encode a single (possibly nested) value."""
+    out = bytearray()
+    _encode_value(value, out)
+    return bytes(out)
+
+def decode_value(block: bytes):
+    """Decode a value written by encode_value."""
+    return _decode_value(memoryview(block), 0)[0]
+
+def encode_metadata(metadata: list) -> bytes:
+    """Encode the metadata (schema) rows of a table."""
+    return encode_value(metadata)
+
+def decode_metadata(block: bytes) -> list:
+    """Decode a metadata block back into a list of rows."""
+    return decode_value(block)
+
+def encode_data(data: list) -> bytes:
+    """Encode table data (column names followed by rows) as typed columns."""
+    out = bytearray()
+    header, rows = (data[0], data[1:]) if data else ([], [])
+    width = len(header)
+    if any(len(row) != width for row in rows):
+        # rows were edited out of shape, keep them as they are
+        out.append(_LAYOUT_ROWS)
+        _encode_value(data, out)
+        return bytes(out)
+    out.append(_LAYOUT_COLUMNS)
+    out += _U32.pack(width) + _U32.pack(len(rows))
+    _encode_value(header, out)
+    for values in zip(*rows) if rows else [[]] * width:
+        _encode_column(list(values), out)
+    return bytes(out)
+
+def decode_data(block: bytes) -> list:
+    """Decode a data block back into column names followed by rows."""
+    buf = memoryview(block)
+    if buf[0] == _LAYOUT_ROWS:
+        return _decode_value(buf, 1)[0]
+    width = _U32.unpack_from(buf, 1)[0]
+    count = _U32.unpack_from(buf, 5)[0]
+    header, pos = _decode_value(buf, 9)
+    columns = []
+    for _ in range(width):
+        values, pos = _decode_column(buf, pos, count)
+        columns.append(values)
+    return [header] + list(map(list, zip(*columns))) if width else [header] + [[] for _ in range(count)]
+
+def encode_columns(columns: list) -> bytes:
+    """Encode a list of typed columns that may have different lengths."""
+    out = bytearray(_U32.pack(len(columns)))
+    for values in columns:
+        out += _U32.pack(len(values))
+        _encode_column(values, out)
+    return bytes(out)
+
+def decode_columns(block: bytes) -> list:
+    """Decode columns written by encode_columns."""
+    buf = memoryview(block)
+    pos = _U32.size
+    columns = []
+    for _ in range(_U32.unpack_from(buf, 0)[0]):
+        count = _U32.unpack_from(buf, pos)[0]
+        values, pos = _decode_column(buf, pos + _U32.size, count)
+        columns.append(values)
+    return columns
+
+# ---------- files ----------
+def pack(meta_block: bytes, data_block: bytes, flags: int = FLAG_COMPRESSED) -> bytes:
+    """Build a full table file from already packed blocks."""
+    return HEADER.pack(MAGIC, VERSION, flags, len(meta_block), len(data_block)) + meta_block + data_block
+
+def read_header(raw: bytes) -> tuple:
+    """Return (metadata block length, data block length, flags) from the start of a table file."""
+    magic, version, flags, meta_size, data_size = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise metaclass.BDBException.ReadError("File is not a BivittatusDB table")
+    if version > VERSION:
+        raise metaclass.BDBException.ReadError(f"Table format version {version} is newer than supported version {VERSION}")
+    return meta_size, data_size, flags
+
+def split(raw: bytes) -> tuple:
+    """Return the still packed (metadata, data) blocks and the flags of a table file."""
+    meta_size, data_size, flags = read_header(raw)
+    start = HEADER.size
+    return raw[start:start + meta_size], raw[start + meta_size:start + meta_size + data_size], flags
+
+def pack_block(block: bytes, flags: int = FLAG_COMPRESSED) -> bytes:
+    """Apply the block level compression."""
+    return zlib.compress(block) if flags & FLAG_COMPRESSED else block
+
+def unpack_block(block: bytes, flags: int) -> bytes:
+    """Undo the block level compression."""
+    return zlib.decompress(block) if flags & FLAG_COMPRESSED else block
+
+def encode_table(data: list, metadata: list) -> bytes:
+    """Encode a whole table file."""
+    return pack(pack_block(encode_metadata(metadata)), pack_block(encode_data(data)))
+
+def decode_legacy(raw: bytes) -> tuple:
+    """Read a table written by the shared library as hexlify(gzip(json)) records."""
+    data = metadata = None
+    pos = 0
+    while pos + _LEGACY_NAME + _LEGACY_SIZE.size <= len(raw):
+        name = raw[pos:pos + _LEGACY_NAME].split(b"\x00", 1)[0]
+        pos += _LEGACY_NAME
+        size = _LEGACY_SIZE.unpack_from(raw, pos)[0]
+        pos += _LEGACY_SIZE.size
+        payload = loads(decompress(unhexlify(raw[pos:pos + size])).decode())
+        pos += size
+        if name.startswith(b"meta_"):
+            metadata = payload
+        else:
+            data = payload
+    if data is None or metadata is None:
+        raise metaclass.BDBException.ReadError("Could not find table records in legacy table file")
+    return data, metadata
@@ -0,0 +1,138 @@
+#Sorted secondary indexes, saved next to each table file (<table>.pydx).
+#An index keeps the values of one column in sorted order together with the position of
+#their row, so range comparisons are answered with two bisections instead of a full scan.
+#None values are not indexed. Handler writes the index file in the same journal batch as
+#the table file, so it always covers the rows of that file; rows appended through the
+#change log are added to the index when the table is loaded. The index file keeps a checksum
+#of the data block of the table file it was built from, an index found next to any other
+#table file (replaced without it, or written by an older version) is rebuilt.
+#
+#layout: magic | compressed columns: names, sizes, keys and row positions per index, checksum
+
+import metaclass
+try:
+    from bisect import bisect_left, bisect_right
+    from itertools import accumulate, chain
+    from operator import itemgetter
+    import zlib
+    import BDB_format
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+MAGIC = b"BDBX"
+
+# operator -> slice of the sorted keys holding the matching values
+_BOUNDS = {
+    "==": lambda keys, value: (bisect_left(keys, value), bisect_right(keys, value)),
+    "<": lambda keys, value: (0, bisect_left(keys, value)),
+    "<=": lambda keys, value: (0, bisect_right(keys, value)),
+    ">": lambda keys, value: (bisect_right(keys, value), len(keys)),
+    ">=": lambda keys, value: (bisect_left(keys, value), len(keys)),
+}
+
+class SortedIndex:
+    def __init__(self, column: str, keys: list = None, ids: list = None, size: int = 0) -> None:
+        self.column = column
+        self.keys = keys if keys is not None else [] #sorted column values
+        self.ids = ids if ids is not None else [] #row position of each key
+        self.size = size #number of rows covered, including rows without a value
+
+    @classmethod
+    def build(cls, column: str, values: list) -> "SortedIndex":
+        """Index the values of a column. Raises TypeError if the values can't be ordered."""
+        order = sorted((i for i, value in enumerate(values) if value is not None), key=values.__getitem__)
+        return cls(column, [values[i] for i in order], order, len(values))
+
+    def append(self, value):
+        """Add the value of a new last row."""
+        if value is not None:
+            position = bisect_right(self.keys, value)
+            self.keys.insert(position, value)
+            self.ids.insert(position, self.size)
+        self.size += 1
+
+    def extend(self, values: list):
+        """Add the values of several new rows."""
+        if len(values) <= 8:
+            for value in values:
+                self.append(value)
+            return
+        #merge in one sort instead of one insertion per row; the sort is stable, so equal keys stay in row order
+        added = ((value, self.size + i) for i, value in enumerate(values) if value is not None)
+        pairs = sorted(chain(zip(self.keys, self.ids), added), key=itemgetter(0))
+        self.keys = [key for key, _ in pairs]
+        self.ids = [i for _, i in pairs]
+        self.size += len(values)
+
+    def update(self, positions: list, old: list, value):
+        """Set the rows at positions (sorted), whose values were old, to value."""
+        if len(positions) <= 8:
+            for position, key in zip(positions, old):
+                if key is not None:
+                    at = self.ids.index(position, bisect_left(self.keys, key), bisect_right(self.keys, key))
+                    del self.keys[at], self.ids[at]
+        else:
+            changed = set(positions)
+            pairs = [(key, i) for key, i in zip(self.keys, self.ids) if i not in changed]
+            self.keys = [key for key, _ in pairs]
+            self.ids = [i for _, i in pairs]
+        if value is not None:
+            at = bisect_right(self.keys, value)
+            self.keys[at:at] = [value] * len(positions)
+            self.ids[at:at] = positions
+
+    def delete(self, keep: list):
+        """Drop the rows whose keep flag is False and renumber the rows after them, in one pass."""
+        position = list(accumulate(keep)) #rows kept up to and including each row
+        pairs = [(key, position[i] - 1) for key, i in zip(self.keys, self.ids) if keep[i]]
+        self.keys = [key for key, _ in pairs]
+        self.ids = [i for _, i in pairs]
+        self.size = position[-1] if position else 0
+
+    def bounds(self, operator: str, value) -> tuple | None:
+        """Slice of the sorted keys matching `column <operator> value`, None if the index can't answer it."""
+        if value is None or operator not in _BOUNDS:
+            return None
+        try:
+            return _BOUNDS[operator](self.keys, value)
+        except TypeError:
+            return None
+
+    def count(self, operator: str, value) -> int | None:
+        """Number of rows matching `column <operator> value` without collecting them, None as in bounds."""
+        bounds = self.bounds(operator, value)
+        return None if bounds is None else bounds[1] - bounds[0]
+
+    def search(self, operator: str, value) -> list | None:
+        """Positions of the rows matching `column <operator> value`, in row order.
+        None if the index can't answer the comparison and the rows have to be scanned."""
+        bounds = self.bounds(operator, value)
+        if bounds is None:
+            return None
+        start, end = bounds
+        return sorted(self.ids[start:end])
+
+def checksum(data_block: bytes) -> int:
+    """Checksum of the data block of a table file, as stored."""
+    return zlib.crc32(data_block)
+
+def encode(indexes: list, data_checksum: int) -> bytes:
+    """Encode the indexes of a table into an index file. data_checksum is the checksum of the data
+    block of the table file they cover."""
+    columns = [[index.column for index in indexes], [index.size for index in indexes]]
+    for index in indexes:
+        columns += [index.keys, index.ids]
+    columns.append([data_checksum])
+    return MAGIC + BDB_format.pack_block(BDB_format.encode_columns(columns))
+
+def decode(raw: bytes) -> tuple:
+    """Decode an index file written by encode. Returns (indexes, checksum of the data block they cover),
+    the checksum being None for files written before it was stored."""
+    if raw[:len(MAGIC)] != MAGIC:
+        raise metaclass.BDBException.ReadError("File is not a BivittatusDB index")
+    columns = BDB_format.decode_columns(BDB_format.unpack_block(raw[len(MAGIC):], BDB_format.FLAG_COMPRESSED))
+    names, sizes = columns[0], columns[1]
+    indexes = [SortedIndex(name, columns[2 + 2 * i], columns[3 + 2 * i], size)
+               for i, (name, size) in enumerate(zip(names, sizes))]
+    data_checksum = columns[2 + 2 * len(names)][0] if len(columns) > 2 + 2 * len(names) else None
+    return indexes, data_checksum
@@ -1,13 +1,16 @@
-from encrypt import KeyManager
-from bdb_aggregate import infomessage
+from encrypt import EnvelopeEncryptor
+from bdb_aggregate import infomessage, ENCRYPT_NONE, ENCRYPT_AT_REST, ENCRYPT_CACHED, KEY_RSA_4096
 import metaclass
 import ctypes
 import os
 import getpass
 import platform
-from json import dumps, loads
-from gzip import compress, decompress
-from binascii import hexlify, unhexlify
+from io import BytesIO
+import BDB_format
+import BDB_index
+import BDB_log
+import BDB_schema
+import BDB_wal
 
 # Import encryption-related functionalities
 try:
@@ -73,33 +76,76 @@ class _CHANDLE:
         result = self._call_lib_function('CheckDataSet', f"./{database.decode()}/{tablename.decode()}".encode(), restype=ctypes.c_int)
         return bool(result)
 
+# Reader for unencrypted table files, same interface as encrypt.SegmentReader
+class _PlainReader:
+    def __init__(self, f) -> None:
+        self.f = f
+        self.size = f.seek(0, os.SEEK_END)
+
+    def read(self, offset: int, size: int) -> bytes:
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def chunks(self):
+        self.f.seek(0)
+        yield self.f.read()
+
 # Main Handler class
 class Handler:
-    def __init__(self, database_name: str, encrypted: bool = False) -> None:
+    POLICIES = {False: ENCRYPT_NONE, True: ENCRYPT_CACHED}
+
+    def __init__(self, database_name: str, encrypted: bool | str = ENCRYPT_CACHED, key_type: str = KEY_RSA_4096) -> None:
         self.writable=False
         self.CHANDLE = _CHANDLE()
-        self.encryptor = RSAFileEncryptor(database_name)
-        self.key_manager = KeyManager(database_name)
         self.database = database_name
-        self.encrypted = encrypted
+        self.policy = self.POLICIES.get(encrypted, encrypted)
+        if self.policy not in (ENCRYPT_NONE, ENCRYPT_AT_REST, ENCRYPT_CACHED):
+            raise metaclass.BDBException.EncryptionError(f"Unknown encryption policy {encrypted}")
+        self.encrypted = self.policy != ENCRYPT_NONE #default for new tables
+        # keys are only loaded (or generated) once something actually needs encrypting
+        self.envelope = EnvelopeEncryptor(None, database_name, cache=self.policy != ENCRYPT_AT_REST, key_type=key_type)
         self.ext = ".pydb"
+        self.log_ext = ".pydl"
+        self.index_ext = ".pydx"
+        self.log_limit = 1 << 20 #bytes of appended changes before the log is folded into the table
+        self.logs = {}
+        self.table_encryption = {} #table name -> whether its file is encrypted
+        self.index_columns = {} #table name -> columns with a sorted index
+        self.replayed = {} #table name -> (rows in the table file, whether the log changed or moved rows, checksum of its data block) of the last read
+        self.schemas = {} #table name -> Schema of its metadata, dropped when the metadata is written
+        self.versions = {} #table name -> number of writes to the table file or its log through this handler
+        self.references = {} #table name -> (stamp, values of its primary key), see ReferencedKeys
+        self.wal = BDB_wal.WriteAheadLog(database_name)
+        self.wal.on_rollback = self._dropped
+
+    @property
+    def encryptor(self) -> RSAFileEncryptor:
+        return self.envelope.rsa
+
+    @property
+    def key_manager(self):
+        return self.encryptor.key_manager
 
     def init(self):
-        """Initialize the database, generate keys, and secure the private key if encryption is enabled."""
+        """Initialize the database. Keys of an encrypted database are generated in the background
+        and only waited for by the first write or read that needs them."""
         self.CHANDLE.CreateDatabase(self.database.encode())
-        infomessage("info: Generating keys...", end='')
-        self.key_manager.key_checker()
         if self.encrypted:
-            self.secure()
+            infomessage("info: Generating keys in the background")
+            self.key_manager.generate_async()
         return self
 
     def use(self):
-        """Prepare the database for use by removing security if encryption is enabled."""
-        if self.encrypted:
-            self.remove_secure()
+        """Prepare the database for use, replaying any unfinished writes."""
+        if self.wal.recover():
+            infomessage("info: Recovered unfinished writes from the journal")
         self.writable=True
         return self
 
+    def batch(self):
+        """Group every write made inside the with block into one journaled commit."""
+        return self.wal.batch()
+
     def secure(self):
         """Secure the private key with a password."""
         password = self._get_password("Enter password to secure the private key: ")
@@ -119,52 +165,208 @@ class Handler:
             else:
                 infomessage("Password cannot be empty. Please try again.", end='')
 
-    def CreateTable(self, tablename: str, data: list, metadata: list):
-        """Create a table with the given name, data, and metadata."""
+    def _table_path(self, tablename: str) -> str:
+        return f"./{self.database}/{tablename}{self.ext}"
+
+    def _log(self, tablename: str) -> BDB_log.TableLog:
+        if tablename not in self.logs:
+            path = f"./{self.database}/{tablename}{self.log_ext}"
+            self.logs[tablename] = BDB_log.TableLog(path, self.envelope, self._table_encrypted(tablename))
+        return self.logs[tablename]
+
+    def _log_exists(self, tablename: str) -> bool:
+        name = tablename + self.log_ext
+        if self.wal.staged(name):
+            return self.wal.pending[name] is not None
+        return self._log(tablename).exists()
+
+    def _open_raw(self, tablename: str):
+        """Stored contents of a table file as a file object, including writes staged in the open batch."""
+        name = tablename + self.ext
+        if self.wal.staged(name):
+            if self.wal.pending[name] is None:
+                raise FileNotFoundError(f"Table {tablename} was deleted")
+            return BytesIO(self.wal.pending[name])
+        return open(self._table_path(tablename), "rb")
+
+    def _table_encrypted(self, tablename: str) -> bool:
+        """Whether a table is stored encrypted. Tables keep the mode they were created with."""
+        if tablename not in self.table_encryption:
+            try:
+                with self._open_raw(tablename) as f:
+                    self.table_encryption[tablename] = f.read(len(BDB_format.MAGIC)) != BDB_format.MAGIC
+            except FileNotFoundError:
+                return self.encrypted
+        return self.table_encryption[tablename]
+
+    def _changed(self, tablename: str):
+        self.versions[tablename] = self.versions.get(tablename, 0) + 1
+
+    def _dropped(self, names: list):
+        """Forget what is cached about the tables of journal writes that never landed. Their version
+        moves on too, so tables and key sets stamped while the writes were staged are stale."""
+        for tablename in {os.path.splitext(name)[0] for name in names}:
+            for cache in (self.schemas, self.references, self.replayed, self.index_columns, self.table_encryption, self.logs):
+                cache.pop(tablename, None)
+            self._changed(tablename)
+
+    def _write_plain(self, tablename: str, raw: bytes, clear_log: bool = False):
+        """Stage the new contents of a table file in the journal, encrypted if the table is."""
+        self._changed(tablename)
+        if self._table_encrypted(tablename):
+            raw = self.envelope.encrypt_data(raw)
+        with self.wal.batch():
+            self.wal.stage(tablename + self.ext, raw)
+            if clear_log and self._log_exists(tablename):
+                self.wal.stage(tablename + self.log_ext, None) #the full data now includes every logged change
+
+    def _read_indexes(self, tablename: str) -> tuple:
+        """(indexes, checksum of the table data they cover), see BDB_index.decode."""
+        name = tablename + self.index_ext
+        if self.wal.staged(name):
+            raw = self.wal.pending[name]
+        elif os.path.exists(f"./{self.database}/{name}"):
+            with open(f"./{self.database}/{name}", "rb") as f:
+                raw = f.read()
+        else:
+            raw = None
+        if not raw:
+            return [], None
+        if raw[:len(BDB_index.MAGIC)] != BDB_index.MAGIC:
+            raw = self.envelope.decrypt_data(raw)
+        return BDB_index.decode(raw)
+
+    def _write_indexes(self, tablename: str, indexes: list, data_checksum: int = None):
+        """Stage the index file of a table, encrypted if the table is. data_checksum is the
+        BDB_index.checksum of the data block of the table file the indexes cover."""
+        raw = BDB_index.encode(indexes, data_checksum) if indexes else None
+        if raw and self._table_encrypted(tablename):
+            raw = self.envelope.encrypt_data(raw)
+        self.wal.stage(tablename + self.index_ext, raw)
+        self.index_columns[tablename] = [index.column for index in indexes]
+
+    def _build_indexes(self, tablename: str, columns: list, data: list) -> list:
+        """Index the given columns of table data (column names followed by rows)."""
+        header, rows = data[0], data[1:]
+        indexes = []
+        for column in columns:
+            position = list(header).index(column)
+            try:
+                indexes.append(BDB_index.SortedIndex.build(column, [row[position] for row in rows]))
+            except TypeError:
+                indexes.append(BDB_index.SortedIndex(column, size=-1)) #keep the declaration, values can't be ordered
+        return indexes
+
+    def _read_blocks(self, tablename: str, meta: bool = True, data: bool = True) -> tuple:
+        """Read the packed blocks of a table file, decrypting only the segments that hold the requested blocks.
+        Legacy files are migrated to the binary format."""
+        with self._open_raw(tablename) as f:
+            if f.read(len(BDB_format.MAGIC)) == BDB_format.MAGIC:
+                reader = _PlainReader(f)
+            else:
+                reader = self.envelope.open(f) #decrypted in memory only, the file is never rewritten by a read
+            header = reader.read(0, BDB_format.HEADER.size)
+            if not BDB_format.is_current(header):
+                rows, metadata = BDB_format.decode_legacy(b"".join(reader.chunks()))
+                raw = BDB_format.encode_table(rows, metadata)
+                self._write_plain(tablename, raw)
+                infomessage(f"info: Migrated table {tablename} to format version {BDB_format.VERSION}")
+                return BDB_format.split(raw)
+            meta_size, data_size, flags = BDB_format.read_header(header)
+            start = BDB_format.HEADER.size
+            meta_block = reader.read(start, meta_size) if meta else None
+            data_block = reader.read(start + meta_size, data_size) if data else None
+        return meta_block, data_block, flags
+
+    def CreateTable(self, tablename: str, data: list, metadata: list, encrypted: bool = None):
+        """Create a table with the given name, data, and metadata. Encrypted follows the database policy unless given."""
         try:
-            data = hexlify(compress(dumps(data).encode()))
-            metadata = hexlify(compress(dumps(metadata).encode()))
-            table_name = (tablename + self.ext).encode()
-            self.CHANDLE.CreateTable(self.database.encode(), table_name, data)
-            self.CHANDLE.AddMetaData(self.database.encode(), table_name, metadata)
-            self.encryptor.encrypt_file(f"./{self.database}/{tablename}.pydb")
+            self.table_encryption[tablename] = self.encrypted if encrypted is None else encrypted
+            self.logs.pop(tablename, None)
+            self.schemas.pop(tablename, None)
+            with self.wal.batch():
+                self._write_plain(tablename, BDB_format.encode_table(data, metadata))
+                self._write_indexes(tablename, [])
         except Exception as e:
             raise metaclass.BDBException.CreationError(f"Problem creating table {tablename}: {e}")
 
     def DeleteTable(self, tablename: str):
         """Delete the table with the given name."""
         try:
-            self.CHANDLE.DeleteTable(self.database.encode(), (tablename + self.ext).encode())
+            with self.wal.batch():
+                self.wal.stage(tablename + self.ext, None)
+                self.wal.stage(tablename + self.log_ext, None)
+                self.wal.stage(tablename + self.index_ext, None)
+            self.table_encryption.pop(tablename, None)
+            self.logs.pop(tablename, None)
+            self.index_columns.pop(tablename, None)
+            self.schemas.pop(tablename, None)
+            self.references.pop(tablename, None)
+            self._changed(tablename)
         except Exception as e:
             raise metaclass.BDBException.DeletionError(f"Problem deleting table {tablename}: {e}")
 
     def UpdateTable(self, tablename: str, data: list):
         """Update the table with the given name with new data."""
         try:
-            self.encryptor.decrypt_file(f"./{self.database}/{tablename}.pydb")
-            data = hexlify(compress(dumps(data).encode()))
-            self.CHANDLE.UpdateTable(self.database.encode(), (tablename + self.ext).encode(), data)
-            self.encryptor.encrypt_file(f"./{self.database}/{tablename}.pydb")
+            meta_block, _, flags = self._read_blocks(tablename, data=False)
+            data_block = BDB_format.pack_block(BDB_format.encode_data(data), flags)
+            with self.wal.batch():
+                self._write_plain(tablename, BDB_format.pack(meta_block, data_block, flags), clear_log=True)
+                columns = self.IndexedColumns(tablename)
+                if columns:
+                    self._write_indexes(tablename, self._build_indexes(tablename, columns, data), BDB_index.checksum(data_block))
         except Exception as e:
             raise metaclass.BDBException.EditError(f"Error updating table {tablename}: {e}")
 
+    def AppendRows(self, tablename: str, rows: list):
+        """Log new rows for the table without rewriting the table file."""
+        self._append_log(tablename, BDB_log.INSERT, rows)
+
+    def DeleteRows(self, tablename: str, indexes: list):
+        """Log the positions of deleted rows without rewriting the table file."""
+        self._append_log(tablename, BDB_log.DELETE, indexes)
+
+    def UpdateRows(self, tablename: str, changes: list):
+        """Log rows changed in place, changes being [row positions, new rows]."""
+        self._append_log(tablename, BDB_log.UPDATE, changes)
+
+    def _append_log(self, tablename: str, op: int, payload: list):
+        try:
+            self._changed(tablename)
+            log = self._log(tablename)
+            log.append(op, payload)
+            if log.size() > self.log_limit:
+                self.CompactTable(tablename)
+        except Exception as e:
+            raise metaclass.BDBException.EditError(f"Error logging changes for table {tablename}: {e}")
+
+    def CompactTable(self, tablename: str):
+        """Fold the change log of a table back into the table file."""
+        if self._log_exists(tablename):
+            self.UpdateTable(tablename, self.ReadTable(tablename))
+
     def UpdateMetaTable(self, tablename: str, metadata: list):
         """Update the metadata of the table with the given name."""
         try:
-            self.encryptor.decrypt_file(f"./{self.database}/{tablename}.pydb")
-            metadata = hexlify(compress(dumps(metadata).encode()))
-            self.CHANDLE.UpdateMetaTable(self.database.encode(), (tablename + self.ext).encode(), metadata)
-            self.encryptor.encrypt_file(f"./{self.database}/{tablename}.pydb")
+            _, data_block, flags = self._read_blocks(tablename, meta=False)
+            meta_block = BDB_format.pack_block(BDB_format.encode_metadata(metadata), flags)
+            self.schemas.pop(tablename, None)
+            self._write_plain(tablename, BDB_format.pack(meta_block, data_block, flags))
         except Exception as e:
             raise metaclass.BDBException.EditError(f"Error updating metadata for table {tablename}: {e}")
 
     def ReadTable(self, tablename: str):
         """Read the data from the table with the given name."""
         try:
-            self.encryptor.decrypt_file(f"./{self.database}/{tablename}.pydb")
-            data = self.CHANDLE.ReadTable(self.database.encode(), (tablename + self.ext).encode(), int(False))
-            data = loads(decompress(unhexlify(data)).decode())
-            self.encryptor.encrypt_file(f"./{self.database}/{tablename}.pydb")
+            _, data_block, flags = self._read_blocks(tablename, meta=False)
+            data = BDB_format.decode_data(BDB_format.unpack_block(data_block, flags))
+            rows, changed = len(data) - 1, False
+            if self._log_exists(tablename):
+                log = self._log(tablename)
+                data = [data[0]] + log.replay(data[1:])
+                changed = log.changed
+            self.replayed[tablename] = (rows, changed, BDB_index.checksum(data_block))
             return data
         except Exception as e:
             raise metaclass.BDBException.ReadError(f"Error reading data from table {tablename}: {e}")
@@ -172,16 +374,110 @@ class Handler:
     def ReadMetadata(self, tablename: str):
         """Read the metadata from the table with the given name."""
         try:
-            self.encryptor.decrypt_file(f"./{self.database}/{tablename}.pydb")
-            metadata = self.CHANDLE.ReadTable(self.database.encode(), (tablename + self.ext).encode(), int(True))
-            metadata = loads(decompress(unhexlify(metadata)).decode())
-            self.encryptor.encrypt_file(f"./{self.database}/{tablename}.pydb")
+            meta_block, _, flags = self._read_blocks(tablename, data=False)
+            metadata = BDB_format.decode_metadata(BDB_format.unpack_block(meta_block, flags))
             return metadata
         except Exception as e:
             raise metaclass.BDBException.ReadError(f"Error reading metadata from table {tablename}: {e}")
 
+    def ReadSchema(self, tablename: str) -> BDB_schema.Schema:
+        """Parsed metadata of the table, read once and kept until UpdateMetaTable changes it."""
+        if tablename not in self.schemas:
+            self.schemas[tablename] = BDB_schema.Schema(self.ReadMetadata(tablename))
+        return self.schemas[tablename]
+
+    def TableStaged(self, tablename: str) -> bool:
+        """Whether a write of the table file is waiting in the open journal batch."""
+        return self.wal.staged(tablename + self.ext)
+
+    def Version(self, tablename: str) -> int:
+        """Number of writes to a table since the database was opened."""
+        return self.versions.get(tablename, 0)
+
+    def _stamp(self, tablename: str) -> tuple:
+        """Modification time and size of the table file and its log, None for a missing file."""
+        stamp = []
+        for ext in (self.ext, self.log_ext):
+            try:
+                stat = os.stat(f"./{self.database}/{tablename}{ext}")
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def Stamp(self, tablename: str) -> tuple:
+        """Changes whenever the table is written: through this handler (its version, which also covers
+        writes staged in an open batch) or on disk by anything else, such as another Database on the
+        same path, an imported table or a recovered journal (modification time and size of its files)."""
+        return (self.Version(tablename), self._stamp(tablename))
+
+    def ReferencedKeys(self, tablename: str) -> frozenset:
+        """Values of the primary key of a table, the keys foreign keys to it are checked against.
+        Read once and kept until the table changes, see Stamp."""
+        stamp = self.Stamp(tablename)
+        cached = self.references.get(tablename)
+        if cached is None or cached[0] != stamp:
+            key = self.ReadSchema(tablename).primary_key
+            cached = (stamp, frozenset(row[key] for row in self.ReadTable(tablename)[1:]))
+            self.references[tablename] = cached
+        return cached[1]
+
+    def IndexedColumns(self, tablename: str) -> list:
+        """Names of the columns of a table that have a sorted index."""
+        if tablename not in self.index_columns:
+            self.index_columns[tablename] = [index.column for index in self._read_indexes(tablename)[0]]
+        return self.index_columns[tablename]
+
+    def ReadIndexes(self, tablename: str) -> dict:
+        """Return column -> SortedIndex for the rows of the table file as read by the last ReadTable.
+        Rows added by the change log still have to be appended. Indexes that no longer match the
+        rows (the log deleted or updated rows, or they were built for another table file) are returned
+        as None and have to be rebuilt."""
+        try:
+            indexes, data_checksum = self._read_indexes(tablename)
+            indexes = {index.column: index for index in indexes}
+        except Exception as e:
+            raise metaclass.BDBException.ReadError(f"Error reading indexes of table {tablename}: {e}")
+        self.index_columns[tablename] = list(indexes)
+        rows, moved, file_checksum = self.replayed.get(tablename, (None, True, None))
+        stale = moved or data_checksum is None or data_checksum != file_checksum
+        for column, index in indexes.items():
+            if stale or index.size != rows:
+                indexes[column] = None
+        return indexes
+
+    def CreateIndex(self, tablename: str, column: str):
+        """Add a sorted index on a column of a table and save it next to the table."""
+        try:
+            data = self.ReadTable(tablename)
+            columns = self.IndexedColumns(tablename)
+            if column not in data[0]:
+                raise ValueError(f"unknown column {column}")
+            if column in columns:
+                return
+            self.index_columns[tablename] = columns + [column]
+            if self._log_exists(tablename):
+                self.UpdateTable(tablename, data) #fold the log in, the index covers the table file
+            else:
+                with self.wal.batch():
+                    self._write_indexes(tablename, self._build_indexes(tablename, columns + [column], data), self.replayed[tablename][2])
+        except Exception as e:
+            self.index_columns.pop(tablename, None)
+            raise metaclass.BDBException.CreationError(f"Error creating index on {column} of table {tablename}: {e}")
+
+    def DropIndex(self, tablename: str, column: str):
+        """Remove the sorted index on a column of a table."""
+        try:
+            indexes, data_checksum = self._read_indexes(tablename)
+            with self.wal.batch():
+                self._write_indexes(tablename, [index for index in indexes if index.column != column], data_checksum)
+        except Exception as e:
+            raise metaclass.BDBException.DeletionError(f"Error dropping index on {column} of table {tablename}: {e}")
+
     def TableExists(self, tablename: str) -> bool:
         """Check if the table with the given name exists in the database."""
+        if self.wal.staged(tablename + self.ext):
+            return self.wal.pending[tablename + self.ext] is not None
         return self.CHANDLE.CheckDataSet(self.database.encode(), (tablename + self.ext).encode())
 
 # Example usage
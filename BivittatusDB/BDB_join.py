@@ -0,0 +1,112 @@
+#Hash join engine for table joins.
+#Rows are joined as they are (tuples or lists), no dicts are built. The hash table is built on
+#the smaller side and every match is emitted, so duplicate keys give one row per matching pair.
+#Output rows follow the order of the driving side (left for inner, left, semi and anti joins,
+#right for right joins). A full join probes with the larger side and emits the unmatched rows
+#of the smaller side at the end. Like in SQL, None keys never match.
+
+import metaclass
+try:
+    from operator import itemgetter
+    from bdb_aggregate import JOIN_INNER, JOIN_LEFT, JOIN_RIGHT, JOIN_SEMI, JOIN_ANTI, JOIN_FULL
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+KINDS = (JOIN_INNER, JOIN_LEFT, JOIN_RIGHT, JOIN_SEMI, JOIN_ANTI, JOIN_FULL)
+
+def layout(left_columns: list, right_columns: list, prefer_right: bool = False) -> tuple:
+    """Columns of a joined row and a function building one from a (left row, right row) pair.
+    Columns in both tables appear once, with the left value (or the right one with prefer_right)."""
+    columns = list(left_columns) + [column for column in right_columns if column not in left_columns]
+    width = len(left_columns)
+    positions = []
+    for column in columns:
+        if column in right_columns and (prefer_right or column not in left_columns):
+            positions.append(width + right_columns.index(column))
+        else:
+            positions.append(left_columns.index(column))
+    if len(positions) == 1:
+        position = positions[0]
+        return columns, lambda left, right: ((*left, *right)[position],)
+    pick = itemgetter(*positions)
+    return columns, lambda left, right: pick((*left, *right))
+
+def _pairs(drive: list, drive_key: int, other: list, other_key: int, outer: bool):
+    """Yield (driving row, matching row) for every match, in driving order. With outer, driving rows
+    without a match are yielded once with None."""
+    if len(other) <= len(drive):
+        table = {}
+        for row in other:
+            if row[other_key] is not None:
+                table.setdefault(row[other_key], []).append(row)
+        for row in drive:
+            matches = table.get(row[drive_key]) if row[drive_key] is not None else None
+            if matches:
+                for match in matches:
+                    yield row, match
+            elif outer:
+                yield row, None
+    else: #hash the smaller driving side, collect the matches per driving row to keep its order
+        table = {}
+        for i, row in enumerate(drive):
+            if row[drive_key] is not None:
+                table.setdefault(row[drive_key], []).append(i)
+        found = {}
+        for row in other:
+            for i in table.get(row[other_key], ()) if row[other_key] is not None else ():
+                found.setdefault(i, []).append(row)
+        for i, row in enumerate(drive):
+            if i in found:
+                for match in found[i]:
+                    yield row, match
+            elif outer:
+                yield row, None
+
+def _full(left: list, left_key: int, right: list, right_key: int, widths: tuple, build, build_right) -> list:
+    """Full outer join in one pass: hash the smaller side, probe with the other, and mark the matched
+    rows of the hashed side in a bitmap to emit the ones left over at the end. widths is the number of
+    columns of the left and right rows."""
+    left_missing, right_missing = (None,) * widths[0], (None,) * widths[1]
+    hash_left = len(left) < len(right)
+    probe, probe_key, hashed, hashed_key = (right, right_key, left, left_key) if hash_left else (left, left_key, right, right_key)
+    pair = (lambda row, match: build(match, row)) if hash_left else build
+    table = {}
+    for i, row in enumerate(hashed):
+        if row[hashed_key] is not None:
+            table.setdefault(row[hashed_key], []).append(i)
+    matched = bytearray(len(hashed))
+    rows = []
+    for row in probe:
+        matches = table.get(row[probe_key]) if row[probe_key] is not None else None
+        if matches:
+            for i in matches:
+                matched[i] = 1
+                rows.append(pair(row, hashed[i]))
+        else:
+            rows.append(build_right(left_missing, row) if hash_left else build(row, right_missing))
+    for i, row in enumerate(hashed):
+        if not matched[i]:
+            rows.append(build(row, right_missing) if hash_left else build_right(left_missing, row))
+    return rows
+
+def join(left: list, left_columns: list, left_key: int, right: list, right_columns: list, right_key: int, how: str = JOIN_INNER) -> tuple:
+    """Join two lists of rows on left[left_key] == right[right_key]. Returns (columns, rows).
+    Semi and anti joins return the left rows with or without a match."""
+    if how not in KINDS:
+        raise ValueError(f"Unknown join {how}")
+    if how in (JOIN_SEMI, JOIN_ANTI):
+        keys = {row[right_key] for row in right}
+        keys.discard(None)
+        keep = how == JOIN_SEMI
+        return list(left_columns), [row for row in left if (row[left_key] in keys) == keep]
+    columns, build = layout(left_columns, right_columns, how == JOIN_RIGHT)
+    if how == JOIN_FULL: #rows only found on the right side take the shared columns from there
+        widths = (len(left_columns), len(right_columns))
+        return columns, _full(left, left_key, right, right_key, widths, build, layout(left_columns, right_columns, True)[1])
+    if how == JOIN_RIGHT:
+        missing = (None,) * len(left_columns)
+        rows = [build(row or missing, match) for match, row in _pairs(right, right_key, left, left_key, True)]
+    else:
+        missing = (None,) * len(right_columns)
+        rows = [build(row, match or missing) for row, match in _pairs(left, left_key, right, right_key, how == JOIN_LEFT)]
+    return columns, rows
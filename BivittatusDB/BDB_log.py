@@ -0,0 +1,160 @@
+#Append-only change log kept next to each table file (<table>.pydl).
+#Small autocommitted changes (inserted rows, deleted row positions, updated rows) are appended here
+#instead of rewriting the whole table. Handler.ReadTable replays the log on top of the
+#table file, and the log is folded back into the table once it grows past a threshold.
+#
+#layout: magic | wrapped key length | RSA wrapped AES key | records
+#record: length | AES-GCM(op + encoded payload)
+#A wrapped key length of 0 means the records use the database data key (see EnvelopeEncryptor),
+#PLAIN_LOG means the records of an unencrypted table are stored as they are.
+
+import metaclass
+try:
+    import os
+    import struct
+    import BDB_format
+    from encrypt import EnvelopeEncryptor, RSAFileEncryptor
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+MAGIC = b"BDBL"
+_KEY_SIZE = struct.Struct("<H")
+_RECORD_SIZE = struct.Struct("<I")
+PLAIN_LOG = 0xFFFF
+
+INSERT = 1
+DELETE = 2
+UPDATE = 3 #payload: [row positions, new rows]
+
+class TableLog:
+    def __init__(self, path: str, envelope: EnvelopeEncryptor, encrypted: bool = True) -> None:
+        self.path = path
+        self.envelope = envelope
+        self.encrypted = encrypted #used for new logs, existing logs say so in their header
+        self.key = None #only set for logs with their own wrapped key or while recrypting
+        self.checked = False
+        self.end = None #offset after the last complete record, as of the last append
+        self.changed = False #whether the last replay deleted (moving the rows after them) or updated rows
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def _read_header(self, f):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise metaclass.BDBException.ReadError(f"{self.path} is not a table log")
+        size = _KEY_SIZE.unpack(f.read(_KEY_SIZE.size))[0]
+        self.encrypted = size != PLAIN_LOG
+        if self.encrypted and size:
+            wrapped = f.read(size)
+            if self.key is None:
+                self.key = self.envelope.rsa.unwrap_key(wrapped)
+        self.checked = True
+
+    def _create(self, key: bytes = None):
+        self.key = key
+        with open(self.path, "wb") as f:
+            f.write(MAGIC + _KEY_SIZE.pack(0 if self.encrypted else PLAIN_LOG))
+            f.flush()
+            os.fsync(f.fileno())
+            self.end = f.tell()
+        self.checked = True
+
+    def _complete(self, f) -> int:
+        """Offset after the last complete record, f being positioned after the header."""
+        end = f.tell()
+        total = f.seek(0, os.SEEK_END)
+        while end + _RECORD_SIZE.size <= total:
+            f.seek(end)
+            size = _RECORD_SIZE.unpack(f.read(_RECORD_SIZE.size))[0]
+            if end + _RECORD_SIZE.size + size > total:
+                break
+            end += _RECORD_SIZE.size + size
+        return end
+
+    def _seal(self, record: bytes) -> bytes:
+        if not self.encrypted:
+            return record
+        return RSAFileEncryptor.encrypt_bytes(self.key or self.envelope.load_key(), record)
+
+    def _unseal(self, record: bytes) -> bytes:
+        if not self.encrypted:
+            return record
+        return RSAFileEncryptor.decrypt_bytes(self.key or self.envelope.load_key(), record)
+
+    def append(self, op: int, payload: list):
+        """Append one change record to the log and sync it to disk. A torn record left at the end
+        by a crash is cut off first, records written after it would never be read."""
+        if not self.exists():
+            self._create()
+        with open(self.path, "r+b") as f:
+            if not self.checked or f.seek(0, os.SEEK_END) != self.end: #first append, or the log changed since
+                f.seek(0)
+                self._read_header(f)
+                self.end = self._complete(f)
+                f.truncate(self.end)
+            record = self._seal(bytes([op]) + BDB_format.encode_value(payload))
+            f.seek(self.end)
+            f.write(_RECORD_SIZE.pack(len(record)) + record)
+            f.flush()
+            os.fsync(f.fileno())
+            self.end = f.tell()
+
+    def records(self):
+        """Yield (op, payload) for every complete record in the log."""
+        if not self.exists():
+            return
+        with open(self.path, "rb") as f:
+            self._read_header(f)
+            while True:
+                size = f.read(_RECORD_SIZE.size)
+                if len(size) < _RECORD_SIZE.size:
+                    break
+                size = _RECORD_SIZE.unpack(size)[0]
+                record = f.read(size)
+                if len(record) < size:
+                    break #torn write at the end of the log, the change never committed
+                record = self._unseal(record)
+                yield record[0], BDB_format.decode_value(record[1:])
+
+    def replay(self, rows: list) -> list:
+        """Apply every logged change to the rows read from the table file."""
+        self.changed = False
+        for op, payload in self.records():
+            if op == INSERT:
+                rows.extend(payload)
+            elif op == DELETE:
+                self.changed = True
+                removed = set(payload)
+                rows = [row for i, row in enumerate(rows) if i not in removed]
+            elif op == UPDATE:
+                self.changed = True
+                for i, row in zip(*payload):
+                    rows[i] = row
+            else:
+                raise metaclass.BDBException.ReadError(f"Unknown log record {op} in {self.path}")
+        return rows
+
+    def recrypt(self, new_key: bytes, old_key: bytes = None):
+        """Re-encrypt every record under a new data key, replacing the log in one step.
+        old_key is the data key the records use now (default: the current database key).
+        Logs of unencrypted tables are left alone."""
+        self.key = None
+        with open(self.path, "rb") as f:
+            self._read_header(f)
+        if not self.encrypted:
+            return
+        if self.key is None:
+            self.key = old_key
+        records = list(self.records())
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(MAGIC + _KEY_SIZE.pack(0))
+            for op, payload in records:
+                record = RSAFileEncryptor.encrypt_bytes(new_key, bytes([op]) + BDB_format.encode_value(payload))
+                f.write(_RECORD_SIZE.pack(len(record)) + record)
+        os.replace(temp_file, self.path)
+        self.key = new_key
+        self.end = None
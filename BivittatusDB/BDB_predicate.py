@@ -0,0 +1,236 @@
+#Predicate engine for table comparisons.
+#The comparison operator is resolved once and a whole column is filtered in one pass,
+#returning the positions (row ids) of the matching rows. Numeric columns are compared as
+#NumPy arrays when NumPy is installed; without it every column takes the pure Python path.
+#
+#Conditions on several columns are combined into query expressions with & (and), | (or) and
+#~ (not). An expression is planned as a whole: the condition a sorted index answers with the
+#fewest rows gives the candidate rows, and the rest of the expression is compiled into a single
+#function, most selective conditions first, that checks the candidates (or all rows) in one pass.
+
+import metaclass
+try:
+    import operator as _operator
+    from abc import ABC, abstractmethod
+    from itertools import compress, count, repeat
+    from functools import reduce
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+OPERATORS = {
+    "==": _operator.eq,
+    "!=": _operator.ne,
+    "<": _operator.lt,
+    "<=": _operator.le,
+    ">": _operator.gt,
+    ">=": _operator.ge,
+}
+
+ORDERING = ("<", "<=", ">", ">=") #comparisons None never meets, like in the sorted indexes
+
+VECTOR_MIN = 1024 #shorter columns are not worth converting to arrays
+
+#estimated share of the rows meeting a comparison on a column without an index
+SELECTIVITY = {
+    "==": 0.05,
+    "!=": 0.95,
+    "<": 1 / 3,
+    "<=": 1 / 3,
+    ">": 1 / 3,
+    ">=": 1 / 3,
+}
+
+def resolve(operator: str):
+    """Resolve an operator string ("==", "<", ...) to its comparison function."""
+    try:
+        return OPERATORS[operator]
+    except KeyError:
+        raise ValueError(f"Unknown comparison operator {operator}")
+
+def vector(values: list):
+    """Return values as a numeric NumPy array, or None if NumPy is missing or the column isn't numeric."""
+    if numpy is None or len(values) < VECTOR_MIN:
+        return None
+    array = numpy.asarray(values)
+    if array.ndim != 1 or array.dtype.kind not in "iuf":
+        return None
+    return array
+
+def select(values: list, operator: str, value, array=None) -> list:
+    """Row ids of the values matching `value_in_column <operator> value`, in order.
+    array is an optional numeric array of the same values (see vector) used for the comparison."""
+    compare = resolve(operator)
+    if array is not None and type(value) in (int, float):
+        try:
+            return numpy.flatnonzero(compare(array, value)).tolist()
+        except OverflowError:
+            pass #integer outside the array type, compare the Python values
+    try:
+        return list(compress(count(), map(compare, values, repeat(value))))
+    except TypeError:
+        if operator not in ORDERING or value is None:
+            raise
+    #None values in the column, which never meet an ordering comparison
+    return [i for i, item in enumerate(values) if item is not None and compare(item, value)]
+
+def select_many(values: list, conditions, array=None) -> list:
+    """Run several (operator, value) conditions over the same column, one row id list per condition."""
+    return [select(values, operator, value, array) for operator, value in conditions]
+
+class Expression(ABC):
+    """Base of the query expressions. index(key) used by the planning methods returns the
+    SortedIndex of a column position or None, size is the number of rows queried."""
+    def __and__(self, other):
+        if not isinstance(other, Expression):
+            return NotImplemented
+        return And(self, other)
+
+    def __or__(self, other):
+        if not isinstance(other, Expression):
+            return NotImplemented
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    @abstractmethod
+    def estimate(self, index, size: int) -> float:
+        """Expected number of matching rows."""
+
+    def candidates(self, index, size: int) -> tuple:
+        """(row ids, rest) where row ids are sorted candidates found with indexes, or None if every
+        row has to be checked, and rest is the expression the candidates still have to meet, or None."""
+        return None, self
+
+    @abstractmethod
+    def compile(self, index, size: int):
+        """Function of a row returning whether it meets the expression."""
+
+class Condition(Expression):
+    """`row[key] <operator> value`"""
+    def __init__(self, key: int, operator: str, value) -> None:
+        self.compare = resolve(operator)
+        self.key = key
+        self.operator = operator
+        self.value = value
+
+    def indexed(self, index) -> int | None:
+        """Number of matching rows counted with the index of the column, None if it has none that can answer."""
+        column = index(self.key)
+        return column.count(self.operator, self.value) if column is not None else None
+
+    def estimate(self, index, size: int) -> float:
+        rows = self.indexed(index)
+        return rows if rows is not None else SELECTIVITY[self.operator] * size
+
+    def candidates(self, index, size: int) -> tuple:
+        column = index(self.key)
+        ids = column.search(self.operator, self.value) if column is not None else None
+        return (None, self) if ids is None else (ids, None)
+
+    def compile(self, index, size: int):
+        key, compare, value = self.key, self.compare, self.value
+        if self.operator in ORDERING and value is not None: #None rows never match, as with an index
+            return lambda row: row[key] is not None and compare(row[key], value)
+        return lambda row: compare(row[key], value)
+
+class And(Expression):
+    def __init__(self, *parts) -> None:
+        self.parts = []
+        for part in parts: #(a & b) & c is kept as one And of a, b and c
+            self.parts += part.parts if isinstance(part, And) else [part]
+
+    def estimate(self, index, size: int) -> float:
+        if not size:
+            return 0
+        rows = size
+        for part in self.parts:
+            rows *= part.estimate(index, size) / size
+        return rows
+
+    def candidates(self, index, size: int) -> tuple:
+        #drive from the indexed condition with the fewest rows, the other parts check its rows
+        driver, fewest = None, None
+        for part in self.parts:
+            if isinstance(part, Condition):
+                rows = part.indexed(index)
+                if rows is not None and (fewest is None or rows < fewest):
+                    driver, fewest = part, rows
+        if driver is None:
+            return None, self
+        ids, _ = driver.candidates(index, size)
+        rest = [part for part in self.parts if part is not driver]
+        return ids, (And(*rest) if len(rest) > 1 else rest[0] if rest else None)
+
+    def compile(self, index, size: int):
+        parts = sorted(self.parts, key=lambda part: part.estimate(index, size))
+        return reduce(_both, [part.compile(index, size) for part in parts])
+
+class Or(Expression):
+    def __init__(self, *parts) -> None:
+        self.parts = []
+        for part in parts:
+            self.parts += part.parts if isinstance(part, Or) else [part]
+
+    def estimate(self, index, size: int) -> float:
+        return min(size, sum(part.estimate(index, size) for part in self.parts))
+
+    def candidates(self, index, size: int) -> tuple:
+        #only worth it when indexes answer every part, otherwise one scan checks everything
+        found, exact = [], True
+        for part in self.parts:
+            ids, rest = part.candidates(index, size)
+            if ids is None:
+                return None, self
+            found.append(ids)
+            exact = exact and rest is None
+        return sorted(set().union(*found)), (None if exact else self)
+
+    def compile(self, index, size: int):
+        parts = sorted(self.parts, key=lambda part: part.estimate(index, size), reverse=True)
+        return reduce(_either, [part.compile(index, size) for part in parts])
+
+class Not(Expression):
+    def __init__(self, part: Expression) -> None:
+        self.part = part
+
+    def __invert__(self):
+        return self.part
+
+    def estimate(self, index, size: int) -> float:
+        return size - self.part.estimate(index, size)
+
+    def candidates(self, index, size: int) -> tuple:
+        ids, rest = self.part.candidates(index, size)
+        if ids is None or rest is not None:
+            return None, self
+        excluded = set(ids)
+        return [i for i in range(size) if i not in excluded], None
+
+    def compile(self, index, size: int):
+        match = self.part.compile(index, size)
+        return lambda row: not match(row)
+
+def _both(first, second):
+    return lambda row: first(row) and second(row)
+
+def _either(first, second):
+    return lambda row: first(row) or second(row)
+
+def evaluate(expression: Expression, rows: list, index) -> list:
+    """Row ids of the rows meeting expression, in order. index(key) returns the SortedIndex of a
+    column position or None. Indexed conditions pick the candidates, everything else is checked
+    in a single pass."""
+    size = len(rows)
+    ids, rest = expression.candidates(index, size)
+    if rest is None:
+        return ids
+    match = rest.compile(index, size)
+    if ids is None:
+        return list(compress(count(), map(match, rows)))
+    return [i for i in ids if match(rows[i])]
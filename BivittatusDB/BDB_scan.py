@@ -0,0 +1,96 @@
+#Integrity scanner behind bdb.scan.
+#A scan checks every row of a table against its schema in a few passes: datatypes (split across
+#a process pool for large tables when asked to), primary key uniqueness with a hash map and foreign keys
+#against the set of keys of the referenced table, loaded once. Every violation is collected
+#into a Report instead of stopping at the first one.
+
+import metaclass
+try:
+    import multiprocessing
+    from collections import Counter, namedtuple
+    from concurrent.futures import ProcessPoolExecutor
+    from BDB_schema import check_rows
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+STRUCTURE = "structure" #row with the wrong number of values
+TYPE = "type" #value not of its column datatype
+PRIMARY = "primary" #primary key already used by an earlier row
+FOREIGN = "foreign" #foreign key not found in the referenced table
+
+PARALLEL_MIN = 200000 #rows before the datatype checks are split across processes, when workers > 1
+
+Violation = namedtuple("Violation", "kind row column value detail")
+
+class Report:
+    """Violations found by a scan, in the order STRUCTURE, TYPE, PRIMARY, FOREIGN."""
+    def __init__(self, table_name: str, rows: int, violations: list) -> None:
+        self.table_name = table_name
+        self.rows = rows #number of rows scanned
+        self.violations = violations
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+    def kinds(self) -> dict:
+        """Number of violations per kind."""
+        return dict(Counter(violation.kind for violation in self.violations))
+
+    def __len__(self) -> int:
+        return len(self.violations)
+
+    def __iter__(self):
+        return iter(self.violations)
+
+    def __str__(self) -> str:
+        counts = ", ".join(f"{kind}: {count}" for kind, count in self.kinds().items())
+        text = f"{self.table_name}: {self.rows} rows scanned, {len(self)} violations" + (f" ({counts})" if counts else "")
+        for violation in self.violations[:20]:
+            text += f"\n  row {violation.row}" + (f" column {violation.column}" if violation.column is not None else "")
+            text += f": {violation.value!r} {violation.detail}"
+        if len(self) > 20:
+            text += f"\n  and {len(self) - 20} more"
+        return text
+
+def _cell_errors(schema, rows: list, workers: int = 1) -> list:
+    #workers are only forked: spawned ones would import the __main__ of the caller again and repeat
+    #its side effects, so without fork (Windows, some macOS setups) the checks stay in this process
+    if len(rows) < PARALLEL_MIN or workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return check_rows(schema.columns, schema.types, schema.type_names, rows)
+    size = -(-len(rows) // workers)
+    try:
+        with ProcessPoolExecutor(workers, multiprocessing.get_context("fork")) as pool:
+            parts = [pool.submit(check_rows, schema.columns, schema.types, schema.type_names, rows[start:start + size], start)
+                     for start in range(0, len(rows), size)]
+            return [error for part in parts for error in part.result()]
+    except (OSError, RuntimeError): #no processes available here, check in this one
+        return check_rows(schema.columns, schema.types, schema.type_names, rows)
+
+def scan(table_name: str, rows: list, schema, primary: int = None, references: set = None, workers: int = 1) -> Report:
+    """Check rows against schema. primary is the position of the primary key column, references
+    the keys of the table its foreign key refers to (None if it has none). workers is the number of
+    processes for the datatype checks of large tables; the default of 1 keeps them in this process."""
+    violations = []
+    structure = set()
+    for i, column, value, expected in _cell_errors(schema, rows, workers):
+        if column is None:
+            structure.add(i)
+            violations.append(Violation(STRUCTURE, i, None, value, f"values, expected {expected}"))
+        else:
+            violations.append(Violation(TYPE, i, column, value, f"is not {expected}"))
+    violations.sort(key=lambda violation: violation.kind != STRUCTURE) #stable, rows stay in order
+    if primary is None:
+        return Report(table_name, len(rows), violations)
+    column = schema.columns[primary]
+    keyed = [(i, row[primary]) for i, row in enumerate(rows) if i not in structure]
+    first = {}
+    for i, key in keyed:
+        if key in first:
+            violations.append(Violation(PRIMARY, i, column, key, f"duplicates row {first[key]}"))
+        else:
+            first[key] = i
+    if references is not None:
+        violations += [Violation(FOREIGN, i, column, key, f"not found in {schema.foreign.FT}")
+                       for i, key in keyed if key not in references]
+    return Report(table_name, len(rows), violations)
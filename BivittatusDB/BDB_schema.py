@@ -0,0 +1,68 @@
+#Parsed table metadata.
+#The metadata of a table is stored as rows of (name, value): one row per column with the name of
+#its datatype, then the primary key, the foreign key and the table referencing this one. Schema
+#reads those rows once into typed attributes and compiles the row validator used by inserts;
+#Handler keeps one Schema per table until the metadata of the table is written again.
+
+import metaclass
+try:
+    import builtins
+    import json
+    from bdb_foreign import Foreign_key
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+NoneType = type(None)
+
+def validator(types: list):
+    """Compile a function checking that a row has one value per column, each of its column type or None."""
+    expected = tuple(types)
+    width = len(expected)
+    def valid(row) -> bool:
+        found = tuple(map(type, row))
+        if found == expected: #no None values, one tuple comparison
+            return True
+        return len(found) == width and all(kind is column or kind is NoneType for kind, column in zip(found, expected))
+    return valid
+
+def check_rows(columns: list, types: list, type_names: list, rows: list, start: int = 0) -> list:
+    """Every bad cell of rows as (row number, column, value, expected type name), rows being numbered
+    from start. A row of the wrong length is reported once, with column None, its length as value and
+    the expected length. A plain function so it can run in other processes."""
+    valid = validator(types)
+    errors = []
+    for i, row in enumerate(rows, start):
+        if valid(row):
+            continue
+        if len(row) != len(types):
+            errors.append((i, None, len(row), len(types)))
+            continue
+        for column, data_type, type_name, value in zip(columns, types, type_names, row):
+            if type(value) is not data_type and value is not None:
+                errors.append((i, column, value, type_name))
+    return errors
+
+def resolve(type_name: str) -> type:
+    """Python type of a datatype name stored in the metadata (int, str, ...)."""
+    data_type = getattr(builtins, type_name, None)
+    if isinstance(data_type, type):
+        return data_type
+    return type(eval(type_name)())
+
+class Schema:
+    def __init__(self, metadata: list) -> None:
+        """metadata is the table returned by Handler.ReadMetadata, header row included."""
+        rows = metadata[1:]
+        self.columns = [row[0] for row in rows[:-3]]
+        self.type_names = [row[1] for row in rows[:-3]]
+        self.types = [resolve(type_name) for type_name in self.type_names]
+        self.valid = validator(self.types)
+        primary, foreign, referenced = rows[-3][1], rows[-2][1], rows[-1][1]
+        self.primary = None if primary == "None" else primary #name of the primary key column
+        self.primary_key = None if self.primary is None else self.columns.index(self.primary) #its position
+        self.foreign = None if foreign == "None" else Foreign_key(*foreign) #FT: the table it refers to
+        self.referenced_by = Foreign_key(*json.loads(referenced)) if referenced else None #FT: the table referring to this one
+
+    def errors(self, rows: list) -> list:
+        """Every bad cell of rows, see check_rows."""
+        return check_rows(self.columns, self.types, self.type_names, rows)
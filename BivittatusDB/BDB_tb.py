@@ -3,16 +3,26 @@ from traceback import format_exc as trace
 try:     
     import datetime, BDB_metadata
     from BDB_io import Handler
+    from BDB_index import SortedIndex
+    import BDB_predicate
+    import BDB_join
+    import BDB_scan
+    from bdb_aggregate import JOIN_INNER, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL
     from tty_log import logger
     from metaclass import TableMeta, BDBException, SavepointMeta, RollbackMeta, CommitMeta
-    from bdb_foreign import Foreign_key, json
     from ast import literal_eval
+    from itertools import compress
+    from operator import itemgetter
+    from weakref import WeakValueDictionary
 except:
     raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
 
 class table(metaclass=TableMeta): ...
 
 class table(metaclass=TableMeta):
+    column_key=None #column selected with table[key]
+    _column=None
+
     def __init__(self, handler:Handler, database, table_name, temp:bool=False, temp_data:list=None) -> table:
         self.io=handler
         self.autocommit=False
@@ -21,6 +31,14 @@ class table(metaclass=TableMeta):
         self.temp=temp
         self.seeker=0
         self.data = None  
+        self.synced=False #True while self.data matches the table file plus its change log
+        self.stamp=None #Handler.Stamp of the table when it was last synced
+        self.pk_index=None #primary key value -> row, built on first use
+        self.indexes={} #column name -> SortedIndex, None while it has to be rebuilt from the rows
+        self.vectors={} #column position -> numeric array of the column, None if it can't be one
+        self.cascaded={} #table name -> referencing table changed by a key update, saved with this one
+        if not hasattr(self, "views"):
+            self.views=WeakValueDictionary() #id -> view over these rows, see __detach_views__
         if self.temp==False:
             self.__read__()
         else:
@@ -46,25 +64,33 @@ class table(metaclass=TableMeta):
     def trace(self):
         self.write_log(trace(), "ERROR")
 
-    def __try_commit__(self):
-        '''is autocommit turned on, it will save the table when a change is made.'''
-        if self.autocommit:
+    def __try_commit__(self, log=None, payload=None):
+        '''is autocommit turned on, it will save the table when a change is made.
+        Changes that can be logged (log, payload) are appended to the table log instead of rewriting the table.'''
+        if not self.autocommit:
+            self.synced=False
+        elif log and self.synced and not self.temp and not self.io.wal.in_batch() and self.stamp==self.io.Stamp(self.table_name):
+            log(self.table_name, payload)
+            self.stamp=self.io.Stamp(self.table_name)
+        else: #logged row positions only hold for the file this table was read from or saved to
             self.__save__()
 
-    def __conv_list_dict__(self):
-        '''convert data to a dictionary for joins'''
-        return [dict(zip(self.columns, row)) for row in self.data]
-    
-    def __conv_dict_list__(self, dicts:dict, other):
-        '''convert data back to a list after joins'''
-        joined_cols = self.columns + [col for col in other.columns if col not in self.columns]
-        return [joined_cols]+[[row.get(col, None) for col in joined_cols] for row in dicts]
-
     def __read__(self):
         '''Read data from a file'''
         try:
+            self.__detach_views__()
             self.data=self.io.ReadTable(self.table_name)
             self.columns=self.data.pop(0)
+            self.synced=True
+            self.stamp=self.io.Stamp(self.table_name)
+            self.pk_index=None
+            self.vectors={}
+            self.cascaded={}
+            self.indexes=self.io.ReadIndexes(self.table_name)
+            for column, index in self.indexes.items():
+                if index is not None and index.size<len(self.data): #rows added by the change log
+                    key=self.columns.index(column)
+                    index.extend([row[key] for row in self.data[index.size:]])
         except:
             self.trace()
             raise BDBException.ReadError(f"Courld not read table {self.table_name}")
@@ -107,7 +133,25 @@ class table(metaclass=TableMeta):
         '''Commit changes to database. Call using save function in main file'''
         if name==None or name==self.table_name:
             self.temp=False
-            self.__edit__()
+            with self.io.wal.batch():
+                self.__edit__()
+                self.__save_cascaded__()
+            self.synced=True
+            self.stamp=self.io.Stamp(self.table_name)
+
+    def __save_cascaded__(self):
+        '''save the referencing tables changed by key updates of this table. Called in the journal batch
+        saving this table, which is dropped unless every one of them is in it'''
+        if not self.cascaded:
+            return
+        for ft in self.cascaded.values():
+            ft.__save__()
+        missing=[name for name in [self.table_name, *self.cascaded] if not self.io.TableStaged(name)]
+        if missing:
+            self.trace()
+            raise BDBException.TransactionError(f"Cascade from {self.table_name} did not write {', '.join(missing)}")
+        #kept until the batch has landed, a dropped batch leaves them to be saved with the next commit
+        self.io.wal.after_commit(self.cascaded.clear)
 
     def __repr__(self) -> list:
         '''return raw data. Call with repr(self)'''
@@ -134,19 +178,38 @@ class table(metaclass=TableMeta):
             return f"Error generating the string representation of the table: {e}"
  
     def __load_metadata__(self):
-        '''Load metadata from database. Used to make checks'''
+        '''Load metadata from database as a table'''
         self.meta=BDB_metadata.table(self.io, self.database, self.table_name)
         return self.meta
+
+    def __schema__(self):
+        '''parsed metadata used to make checks, read once per table by the handler'''
+        return self.io.ReadSchema(self.table_name)
     
-    def __load_refrenced__(self):
-        meta=self.__load_metadata__()
-        key=meta[1].column.pop(-1)
-        if key=="":
-            return None
-        key=json.loads(key)
-        fkey=Foreign_key(*key)
-        FT=table(self.io, self.database, fkey.FT)
-        return FT.__fix_index__(key[1]), FT
+    def __plan_cascade__(self, old, new)->list:
+        '''follow the tables referencing this one through their metadata, loading each once, and collect
+        the rows whose key goes from old to new with this change. Nothing is changed yet, so a key clash
+        further down raises before any table is touched. Returns [(table, key column, row positions)]'''
+        plan=[]
+        seen={self.table_name}
+        fkey=self.__schema__().referenced_by
+        while fkey is not None and fkey.FT not in seen:
+            seen.add(fkey.FT)
+            ft=self.cascaded.get(fkey.FT) #pending changes first, an empty table is still pending
+            if ft is None:
+                ft=table(self.io, self.database, fkey.FT)
+            key=ft.__get_primary__() #foreign keys are checked on the primary key of the referencing table
+            if key is None:
+                break
+            rows=[i for i, row in enumerate(ft.data) if row[key]==old]
+            if not rows:
+                break
+            if new in ft.__primary_index__():
+                self.trace()
+                raise metaclass.BDBException.KeyError(f"primary key {new} is already in primary key of {ft.table_name}")
+            plan.append((ft, key, rows))
+            fkey=ft.__schema__().referenced_by
+        return plan
 
     def __len__(self)->int:
         '''return the number of values in the data'''
@@ -159,47 +222,177 @@ class table(metaclass=TableMeta):
         return key
     
     def __get_primary__(self):
-        return self.__fix_index__(self.__load_metadata__()[1].column.pop(-3))
+        '''index of the primary key column, None if the table has none. Only read from the metadata once'''
+        if not hasattr(self, "primary"):
+            key=self.__schema__().primary
+            self.primary=None if key is None else self.__fix_index__(key)
+        return self.primary
+
+    def __primary_index__(self)->dict:
+        '''hash index of the primary key. Kept in sync by changes to the rows, rebuilt after bulk changes'''
+        if self.pk_index is None:
+            key=self.__get_primary__()
+            if key is None:
+                raise metaclass.BDBException.KeyError(f"Table {self.table_name} has no primary key")
+            self.pk_index={row[key]:row for row in self.data}
+        return self.pk_index
+
+    def __detach_views__(self):
+        '''views over these rows are about to go stale, so they take their own copy of the rows first'''
+        for other in list(self.views.values()):
+            other.__detach__()
+        self.views.clear()
+
+    def __reindex__(self):
+        '''drop the indexes after changes that replace or move rows, they are rebuilt on the next lookup'''
+        self.pk_index=None
+        self.indexes=dict.fromkeys(self.indexes)
+        self.vectors={}
+
+    def __vector__(self, key:int, values:list):
+        '''numeric array of a column (values) for vectorized comparisons, cached until the rows change'''
+        if key not in self.vectors:
+            self.vectors[key]=BDB_predicate.vector(values)
+        return self.vectors[key]
+
+    def select(self, column: int | str, operator: str, value)->list:
+        '''row ids of the rows where `column <operator> value`, using an index when the column has one'''
+        key=self.__fix_index__(column)
+        index=self.__sorted_index__(key)
+        rows=index.search(operator, value) if index is not None else None
+        if rows is None:
+            values=[row[key] for row in self.data]
+            rows=BDB_predicate.select(values, operator, value, self.__vector__(key, values))
+        return rows
+
+    def select_many(self, conditions)->list:
+        '''run several (column, operator, value) conditions, one list of row ids per condition'''
+        return [self.select(column, operator, value) for column, operator, value in conditions]
+
+    def __sorted_index__(self, key:int):
+        '''sorted index of a column, or None if the column has none'''
+        column=self.columns[key]
+        if column not in self.indexes:
+            return None
+        if self.indexes[column] is None:
+            try:
+                self.indexes[column]=SortedIndex.build(column, [row[key] for row in self.data])
+            except TypeError:
+                return None #values that can't be ordered, comparisons scan the rows
+        return self.indexes[column]
+
+    def create_index(self, column: str):
+        '''keep a sorted index of a column, used by the ==, <, <=, > and >= comparisons. Saved with the table'''
+        self.__fix_index__(column)
+        if not self.temp:
+            self.io.CreateIndex(self.table_name, column)
+        self.indexes.setdefault(column, None)
+        return self
+
+    def drop_index(self, column: str):
+        '''remove the sorted index of a column'''
+        if not self.temp:
+            self.io.DropIndex(self.table_name, column)
+        self.indexes.pop(column, None)
+        return self
+
+    def __unindex__(self, row):
+        if self.pk_index is not None and self.pk_index.get(row[self.primary]) is row:
+            del self.pk_index[row[self.primary]]
+
+    def get(self, pk, default=None):
+        '''return the row with primary key pk, or default'''
+        return self.__primary_index__().get(pk, default)
+
+    def get_many(self, pks)->list:
+        '''return the rows for the given primary keys, in order. Keys that are not in the table are skipped'''
+        index=self.__primary_index__()
+        return [index[pk] for pk in pks if pk in index]
 
     def __getitem__(self, key: int | str | None):
         '''return a column from the data. Requirement to compare data'''
         if key == None:
             key=self.__get_primary__()
-        self.column=[]
-        data=self.data
         self.key=self.__fix_index__(key)
-        for row in data:
-            self.column.append(row[self.key])
+        self.column_key=self.key
+        self._column=None
         return self
+
+    @property
+    def column(self)->list:
+        '''values of the column selected with table[key], only built when they are used'''
+        if self.column_key is None:
+            raise AttributeError("column")
+        if self._column is None:
+            self._column=self.__values__(self.column_key)
+        return self._column
+
+    @column.deleter
+    def column(self):
+        self.column_key=None
+        self._column=None
+
+    def __values__(self, key:int)->list:
+        return [row[key] for row in self.data]
     
     def __setitem__(self, key: int | str | None, value: any):
-        '''update values'''
+        '''update values. Call using self[key]=(selection, new_value), selection being a comparison
+        of the table (or a table of some of its rows) or ALL (None). The rows are changed in place'''
         if key==None:
             key=self.__get_primary__()
         key=self.__fix_index__(key)
-        if type(value[0])==table:
-            data=value[0].data
-            self[key]-data[0][key] #remove data
-            val=data[0][key]
-        elif value[0]==None: #none to change all date
-            data=self.data
-            self.data=[]
-            val=None
-        
-        for row in [list(row) for row in data]:
-            row[key]=value[1]
-            self+tuple(row) #add updated data
-        self*0 # sort by key
-        
-        #update foreign refrences
-        ref=self.__load_refrenced__()
-        if ref!=None:
-            fkey, ft=ref
-            ft@True
-            ft[fkey]=(ft[fkey]==val, value[1])
-            ft.__try_commit__()
+        selection, new=value
+        rows=list(range(len(self))) if selection is None else self.__positions__(selection)
+        if not rows:
+            return
+        data=self.data
+        self.__check_update__(key, new, rows)
+        plan=None
+        if key==self.__get_primary__() and data[rows[0]][key]!=new: #only the primary key is referenced
+            plan=self.__plan_cascade__(data[rows[0]][key], new)
+        if not plan:
+            self.__commit_update__(key, rows, new)
+            return
+        #the referencing tables follow the commits of this one: they are saved in the same journal
+        #batch when it is saved, each once, so neither side is written without the other
+        for ft, fkey, frows in plan:
+            ft.__change_rows__(fkey, frows, new)
+            self.cascaded[ft.table_name]=ft
+        self.__change_rows__(key, rows, new)
         self.__try_commit__()
 
+    def __change_rows__(self, key:int, rows:list, new)->bool:
+        '''set column key of the rows at positions rows to new, keeping the indexes in sync.
+        Returns False if the rows were sorted again, which moves them'''
+        data=self.data
+        self.__detach_views__()
+        old=[data[i][key] for i in rows]
+        primary=self.primary if self.pk_index is not None else None
+        for i in rows:
+            row=list(data[i])
+            row[key]=new
+            row=tuple(row)
+            if primary is not None:
+                self.__unindex__(data[i])
+                self.pk_index[row[primary]]=row
+            data[i]=row
+        index=self.indexes.get(self.columns[key])
+        if index is not None:
+            index.update(rows, old, new)
+        self.vectors.pop(key, None)
+        if key==0: #rows are kept in order of the first column
+            data.sort(key=itemgetter(0))
+            self.indexes=dict.fromkeys(self.indexes)
+            self.vectors={}
+            return False
+        return True
+
+    def __commit_update__(self, key:int, rows:list, new):
+        if self.__change_rows__(key, rows, new):
+            self.__try_commit__(self.io.UpdateRows, [rows, [self.data[i] for i in rows]])
+        else: #sorting moved the rows, so the table is saved
+            self.__try_commit__()
+
     def __empty_check__(self):
         if len(self) == 0:
             self.trace()
@@ -237,182 +430,250 @@ class table(metaclass=TableMeta):
         '''sort a the data by specified column (key). call using self*key (0 indexed)'''
         self.__empty_check__()
         key=self.__fix_index__(key)
+        self.__detach_views__()
         self.data=sorted(self.data, key=lambda x: x[key])
+        self.indexes=dict.fromkeys(self.indexes) #rows moved, the primary key index holds rows and stays valid
+        self.vectors={}
         self.__try_commit__()
         return self
 
     def __check_type__(self, new_data: tuple)->bool:
         '''Check new rows against specified datatypes'''
-        data_types=self.__load_metadata__()[1].column
-        if (len(data_types)-3) != (len(new_data)):
+        if self.__schema__().valid(new_data):
+            return True
+        return self.__check_cells__([new_data])
+
+    def __check_cells__(self, rows:list)->bool:
+        '''check the structure and datatypes of rows, reporting every bad cell at once'''
+        errors=self.__schema__().errors(rows)
+        if not errors:
+            return True
+        self.trace()
+        structure=[error for error in errors if error[1] is None]
+        errors=structure or errors
+        shown=errors[:20]
+        more=f" and {len(errors)-len(shown)} more" if len(errors)>len(shown) else ""
+        if structure:
+            cells=", ".join(f"row {i} has {found} values, expected {width}" for i, _, found, width in shown)
+            raise metaclass.BDBException.StructureError(f"new data doesn't match table structure: {cells}{more}")
+        cells=", ".join(f"row {i} column {column}: {value!r} is not {type_name}" for i, column, value, type_name in shown)
+        raise metaclass.BDBException.TypeError(f"New data does not match defined datatypes: {cells}{more}")
+
+    def __check_update__(self, key:int, new, rows:list)->bool:
+        '''check a new value for one column of the rows at positions rows'''
+        if type(new) is not self.__schema__().types[key] and new is not None:
             self.trace()
-            raise metaclass.BDBException.StructureError("new data doesn't match table structure")
-        for i in range(len(new_data)):
-            if type(eval(data_types[i])()) != type(new_data[i]) and type(new_data[i]) != type(None):
-                self.trace()
-                raise metaclass.BDBException.TypeError("New data does not match defined datatypes.")
-        return True
+            raise metaclass.BDBException.TypeError("New data does not match defined datatypes.")
+        if key!=self.__get_primary__():
+            return True
+        holder=self.__primary_index__().get(new)
+        if len(rows)>1 or (new in self.pk_index and holder is not self.data[rows[0]]):
+            self.trace()
+            raise metaclass.BDBException.KeyError(f"primary key {new} is already in primary key")
+        row=list(self.data[rows[0]])
+        row[key]=new
+        return self.__check_foreign__(tuple(row))
 
     def __check_primary__(self, new_data: tuple)->bool:
         '''ensure primary key integrity'''
-        key=self.__fix_index__(self.__load_metadata__()[1].column.pop(-3))
-        if new_data[key] in self[key].column:
+        key=self.__get_primary__()
+        if key is None:
+            return True
+        if new_data[key] in self.__primary_index__():
             self.trace()
             raise metaclass.BDBException.KeyError(f"primary key {new_data[key]} is already in primary key")
         return True
     
-    def __load_foreign__(self, other: str):
-        other=table(self.io, self.database, other)
-        return other
-
     def __check_foreign__(self, new_data:tuple)->bool:
         '''Ensure new data fits the foreign key constraints'''
-        meta=self.__load_metadata__()
-        if meta[1].column.pop(-2) == "None":
+        foreign=self.__schema__().foreign
+        if foreign is None:
             return True
-        key=self.__fix_index__(meta[1].column.pop(-3))
-        other_name=self.__load_metadata__()[1].column.pop(-2)[0]
-        other:table=self.__load_foreign__(other_name)
-        other_key = other.__fix_index__(other.__load_metadata__()[1].column.pop(-3))
-        if new_data[key] in other[other_key]:
+        key=self.__get_primary__()
+        if new_data[key] in self.io.ReferencedKeys(foreign.FT):
             return True
         else:
             self.trace()
-            raise metaclass.BDBException.RefError(f"Value {new_data[key]} not found in {other_name}")
+            raise metaclass.BDBException.RefError(f"Value {new_data[key]} not found in {foreign.FT}")
 
     def __add__(self, value:tuple)->None:
         '''add new row to the table. call using self+value'''
         if self.__check_type__(value) and self.__check_primary__(value) and self.__check_foreign__(value):
+            if self.views:
+                self.__detach_views__()
             self.data.append(value)
-        self.__try_commit__()
+            if self.pk_index is not None:
+                self.pk_index[value[self.primary]]=value
+            for column, index in self.indexes.items():
+                if index is not None:
+                    index.append(value[self.columns.index(column)])
+            self.vectors={}
+        self.__try_commit__(self.io.AppendRows, [value])
+
+    def extend(self, rows)->int:
+        '''add many rows at once. The whole batch is checked first, with the metadata loaded once,
+        then appended and committed (or logged) once. Nothing is added if any row fails a check'''
+        rows=list(rows)
+        if not rows:
+            return 0
+        self.__check_rows__(rows)
+        if self.views:
+            self.__detach_views__()
+        self.data.extend(rows)
+        if self.pk_index is not None:
+            self.pk_index.update((row[self.primary], row) for row in rows)
+        for column, index in self.indexes.items():
+            if index is not None:
+                key=self.columns.index(column)
+                index.extend([row[key] for row in rows])
+        self.vectors={}
+        self.__try_commit__(self.io.AppendRows, rows)
+        return len(rows)
+
+    insert_many=extend
+
+    def __check_rows__(self, rows:list)->bool:
+        '''check a batch of new rows against the datatypes, primary key and foreign key, one pass per check'''
+        valid=self.__schema__().valid
+        if not all(map(valid, rows)):
+            self.__check_cells__(rows)
+        foreign=self.__schema__().foreign
+        key=self.__get_primary__()
+        if key is None:
+            return True
+        existing, seen=self.__primary_index__(), set()
+        for row in rows:
+            if row[key] in existing or row[key] in seen:
+                self.trace()
+                raise metaclass.BDBException.KeyError(f"primary key {row[key]} is already in primary key")
+            seen.add(row[key])
+        if foreign is not None:
+            missing=seen.difference(self.io.ReferencedKeys(foreign.FT))
+            if missing:
+                self.trace()
+                raise metaclass.BDBException.RefError(f"Value {missing.pop()} not found in {foreign.FT}")
+        return True
         
     def __find_compare__(self, operator:str, value):
         self.value=value
         '''used to remove all data not meeting opperator requirments.'''
         self.__empty_check__()
-        if not self.column:
+        if self.column_key is None:
             self.trace()
             raise BDBException.ColumunError(f"Must Index Column to use comparison {operator}")
-        data=self.column
-        rows=[]
-        for i in range(len(data)):
-            if eval(f"data[i]{operator}value"):
-                rows.append(i)
+        index=self.__sorted_index__(self.key)
+        rows=index.search(operator, value) if index is not None else None
+        if rows is None:
+            rows=BDB_predicate.select(self.column, operator, value, self.__vector__(self.key, self.column))
         return rows
     
-    def __sub__(self, value: any):
-        '''remove all rows containing value in specified column'''
-        rows=self.__find_compare__("==", value)
+    def __sub__(self, value: any)->int:
+        '''remove all rows containing value in specified column, or all rows of a view of the table.
+        Call using self[key]-value or self-(self[key]>value). Returns the number of rows removed'''
+        if isinstance(value, view):
+            return self.delete(value)
+        return self.__remove_rows__(self.__find_compare__("==", value))
+
+    def delete(self, where)->int:
+        '''remove the rows picked by where: a view of this table (any comparison or combined query)
+        or a list of row positions. Returns the number of rows removed'''
+        return self.__remove_rows__(self.__positions__(where))
+
+    def __positions__(self, where)->list:
+        '''sorted positions of the rows picked by where: a view of this table, a list of positions,
+        or a table holding some of the rows'''
+        if isinstance(where, view):
+            if where.parent is self and where.rows is None:
+                return where.__ids__()
+            if where.columns!=self.columns:
+                self.trace()
+                raise BDBException.QueryError(f"Can't pick rows of {where.parent.table_name} from {self.table_name}")
+            return view(self, where.query).__ids__() #pick the rows again from this table
+        if isinstance(where, table):
+            picked={tuple(row) for row in where.data}
+            return [i for i, row in enumerate(self.data) if tuple(row) in picked]
+        return sorted(set(where))
+
+    def __remove_rows__(self, rows:list)->int:
+        '''remove the rows at the sorted positions rows, compacting the data in one pass'''
+        if not rows:
+            return 0
+        self.__detach_views__()
+        data=self.data
+        keep=[True]*len(data)
         for i in rows:
-            self.data.pop(i-rows.index(i))
-        self.__try_commit__()
+            keep[i]=False
+            self.__unindex__(data[i])
+        data[:]=compress(data, keep)
+        for index in self.indexes.values():
+            if index is not None:
+                index.delete(keep)
+        self.vectors={}
+        self.__try_commit__(self.io.DeleteRows, rows)
+        return len(rows)
         
+    def __filter__(self, operator:str, value):
+        '''return a view of the rows meeting `column <operator> value`. Rows are only picked once the view is used'''
+        self.__empty_check__()
+        if self.column_key is None:
+            self.trace()
+            raise BDBException.ColumunError(f"Must Index Column to use comparison {operator}")
+        return view(self, BDB_predicate.Condition(self.column_key, operator, value))
+
     def __eq__(self, value):
-        '''return table of all value meeting operand =='''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__("==", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand =='''
+        return self.__filter__("==", value)
     
     def __ne__(self, value):
-        '''return table of all value meeting operand !='''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__("!=", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand !='''
+        return self.__filter__("!=", value)
     
     def __lt__(self, value):
-        '''return table of all value meeting operand <'''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__("<", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand <'''
+        return self.__filter__("<", value)
     
     def __le__(self, value):
-        '''return table of all value meeting operand <='''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__("<=", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand <='''
+        return self.__filter__("<=", value)
     
     def __gt__(self, value):
-        '''return table of all value meeting operand >'''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__(">", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand >'''
+        return self.__filter__(">", value)
     
     def __ge__(self, value):
-        '''return table of all value meeting operand >'''
-        time=datetime.datetime.now()
-        rows=self.__find_compare__(">=", value)
-        table_data=[self.columns]
-        for row in rows:
-            table_data.append(self.data[row])
-        return table(self.io, self.database, f"pydb_{time}", True, table_data)
+        '''return a view of all rows meeting operand >'''
+        return self.__filter__(">=", value)
     
-    def __lshift__(self, other):
-        '''left join tables. call using table1<<table2'''
+    def __join_key__(self)->int:
+        '''column to join on: the column selected with table[key], else the primary key'''
+        if self.column_key is not None:
+            return self.column_key
+        if not self.temp or isinstance(self, view):
+            key=self.__get_primary__()
+            if key is not None:
+                return key
+        self.trace()
+        raise BDBException.ColumunError(f"Must Index Column to join table {self.table_name}")
+
+    def join(self, other, how:str=JOIN_INNER):
+        '''join tables on the columns selected with table[key] (the primary keys if none are).
+        how is one of JOIN_INNER, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL, JOIN_SEMI or JOIN_ANTI. Returns a temp table'''
         self.__empty_check__()
         time=datetime.datetime.now()
-        left_table=self.__conv_list_dict__()
-        left_cols =self.columns
-        join_key_left=self.columns[self.key]
-        right_table=other.__conv_list_dict__()
-        right_cols=other.columns
-        join_key_right=other.columns[other.key]
-
-        right_dict= {row[join_key_right]:row for row in right_table}
-        joined_table=[]
-        for left_row in left_table:
-            key= left_row[join_key_left]
-            matched_row=right_dict.get(key, {})
-            combine_row={**left_row, **{col:matched_row.get(col, None) for col in right_cols if col not in left_cols}}
-            joined_table.append(combine_row)
-        joined_table=self.__conv_dict_list__(joined_table, other)
-        return table(self.io, self.database, f"pydb_{time}", True, joined_table)
+        columns, rows=BDB_join.join(self.data, self.columns, self.__join_key__(), other.data, other.columns, other.__join_key__(), how)
+        return table(self.io, self.database, f"pydb_{time}", True, [columns]+rows)
+
+    def __lshift__(self, other):
+        '''left join tables. call using table1<<table2'''
+        return self.join(other, JOIN_LEFT)
 
     def __rshift__(self, other):
         '''right join tables. Call using table1>>table2'''
-        self.__empty_check__()
-        time=datetime.datetime.now()
-        left_table=self.__conv_list_dict__()
-        left_cols =self.columns
-        join_key_left=self.columns[self.key]
-        right_table=other.__conv_list_dict__()
-        right_cols=other.columns
-        join_key_right=other.columns[other.key]
-
-        left_dict = {row[join_key_left]:row for row in left_table}
-        joined_table=[]
-        
-        for right_row in right_table:
-            key=right_row[join_key_right]
-            matched_row = left_dict.get(key, {})
-            combined_row = {**{col: matched_row.get(col, None) for col in left_cols if col not in right_cols}, **right_row}
-            joined_table.append(combined_row)
-        joined_table=self.__conv_dict_list__(joined_table, other)
-        return table(self.io, self.database, f"pydb_{time}", True, joined_table)
+        return self.join(other, JOIN_RIGHT)
 
     def __xor__(self, other):
         '''full join tables. Call using table1^table2'''
-        self.__empty_check__()
-        time=datetime.datetime.now()
-        ljoin = (self << other).__conv_list_dict__()
-        rjoin = (self >> other).__conv_list_dict__()
-        full_join = {tuple(row.items()): row for row in ljoin+rjoin}.values()
-        full_join = self.__conv_dict_list__(full_join, other)
-        return table(self.io, self.database, f"pydb_{time}", True, full_join)
+        return self.join(other, JOIN_FULL)
     
     def __matmul__(self, bool):
         '''set autocommit. call using table@bdb.ON or table@bdb.OFF'''
@@ -426,24 +687,30 @@ class table(metaclass=TableMeta):
         elif type(other)==type(COMMIT):
             COMMIT.__matmul__(other, self)
 
-    def __scan__(self):
-        for row in self.data:
-            if self.__check_foreign__(row) and self.__check_type__(row) and self.__scan_primary__():
-                continue
+    def __scan__(self, raise_errors:bool=True, workers:int=1):
+        '''check every row for datatypes, unique primary keys and foreign keys. Returns a BDB_scan.Report
+        of every violation; unless raise_errors is False, the first kind found is also raised.
+        workers > 1 checks the datatypes of large tables in that many forked processes'''
+        schema=self.__schema__()
+        primary=self.__get_primary__()
+        references=None
+        if schema.foreign is not None and primary is not None:
+            references=self.io.ReferencedKeys(schema.foreign.FT)
+        report=BDB_scan.scan(self.table_name, self.data, schema, primary, references, workers)
+        if raise_errors and not report.ok:
+            self.trace()
+            error={BDB_scan.STRUCTURE: BDBException.StructureError, BDB_scan.TYPE: BDBException.TypeError,
+                   BDB_scan.PRIMARY: BDBException.KeyError, BDB_scan.FOREIGN: BDBException.RefError}
+            raise error[report.violations[0].kind](str(report))
+        return report
 
     def contains_duplicates(self, lst):
-        for i in range(len(lst)):
-            for j in range(i + 1, len(lst)):
-                if lst[i] == lst[j]:
-                    return True
+        seen=set()
+        for item in lst:
+            if item in seen:
+                return True
+            seen.add(item)
         return False
-
-    def __scan_primary__(self):
-        key=self.__fix_index__(self.__load_metadata__()[1].column.pop(-3))
-        if self.contains_duplicates(self[key].column):
-            self.trace()
-            raise metaclass.BDBException.KeyError(f"primary key is duplicated in {self.table_name}: {self.column}")
-        return True
     
     def __invert__(self):
         self.__init__(self.io, self.database, self.table_name,self.temp, self.data)
@@ -462,13 +729,19 @@ class table(metaclass=TableMeta):
                 self.__add__(value)
         else:
             self.seeker=line
+            self.__detach_views__()
             self.data[line]=value #specify line parameter to overwrite data (not recommended)
+            self.synced=False
+            self.__reindex__()
 
     def writeable(self)->bool:
         return self.io.writable
     
     def truncate(self, lines:int)->int:
+        self.__detach_views__()
         del self.data[lines:]
+        self.synced=False
+        self.__reindex__()
         return lines
     
     def tell(self)->int:
@@ -525,6 +798,112 @@ class table(metaclass=TableMeta):
         return None
 
 
+class view(table):
+    '''Rows of a parent table picked by comparisons. A view keeps its query and the positions
+    of the matching parent rows instead of a copy of them. Comparing a column of a view adds a
+    condition, and views of the same table combine with & (and), | (or) and ~ (not). The whole
+    query is planned and run in a single pass over the parent rows the first time the view is used.
+    The rows are only copied when they are needed as a list (data, saving the view) or when the
+    parent is about to change.'''
+    def __init__(self, parent:table, query:BDB_predicate.Expression) -> None:
+        self.parent=parent
+        self.query=query #rows of the parent meeting this expression are in the view
+        self.io=parent.io
+        self.database=parent.database
+        self.table_name=f"pydb_{datetime.datetime.now()}"
+        self.columns=parent.columns
+        self.temp=True
+        self.autocommit=False
+        self.seeker=0
+        self.synced=False
+        self.stamp=None
+        self.pk_index=None
+        self.indexes={}
+        self.vectors={}
+        self.cascaded={}
+        self.views=WeakValueDictionary()
+        self.ids=None #positions of the matching parent rows, found on first use
+        self.rows=None #own copy of the rows, once the view no longer reads through to the parent
+        self.logger=None
+        parent.views[id(self)]=self
+
+    def log(self):
+        self.logger=logger(f"{self.database}/{self.table_name}")
+        self.logger.start()
+
+    def __ids__(self)->list:
+        '''positions of the parent rows meeting the query, found in one pass'''
+        if self.ids is None:
+            parent, query=self.parent, self.query
+            if isinstance(query, BDB_predicate.Condition): #a single comparison can use vectors too
+                self.ids=parent.select(query.key, query.operator, query.value)
+            else:
+                self.ids=BDB_predicate.evaluate(query, parent.data, parent.__sorted_index__)
+        return self.ids
+
+    def __detach__(self):
+        '''copy the matching rows, after this the view no longer depends on its parent'''
+        if self.rows is None:
+            data=self.parent.data
+            self.rows=[data[i] for i in self.__ids__()]
+            self.parent.views.pop(id(self), None)
+
+    @property
+    def data(self)->list:
+        self.__detach__()
+        return self.rows
+
+    @data.setter
+    def data(self, rows:list):
+        self.parent.views.pop(id(self), None)
+        self.rows=rows
+
+    def __values__(self, key:int)->list:
+        if self.rows is not None:
+            return [row[key] for row in self.rows]
+        data=self.parent.data
+        return [data[i][key] for i in self.__ids__()]
+
+    def __len__(self)->int:
+        return len(self.rows) if self.rows is not None else len(self.__ids__())
+
+    def __get_primary__(self):
+        '''the primary key and schema of the parent, the view has no table file of its own'''
+        if not hasattr(self, "primary"):
+            self.primary=self.parent.__get_primary__()
+        return self.primary
+
+    def __schema__(self):
+        return self.parent.__schema__()
+
+    def __filter__(self, operator:str, value):
+        if self.rows is None and self.column_key is not None:
+            return view(self.parent, self.query & BDB_predicate.Condition(self.column_key, operator, value))
+        return super().__filter__(operator, value)
+
+    def __same_parent__(self, other)->bool:
+        if not isinstance(other, view):
+            return False
+        if other.parent is not self.parent:
+            self.trace()
+            raise BDBException.QueryError(f"Can't combine comparisons of {self.parent.table_name} and {other.parent.table_name}")
+        return True
+
+    def __and__(self, other):
+        '''rows meeting both queries. Call using (table[a]>x) & (table[b]==y)'''
+        if not self.__same_parent__(other):
+            return NotImplemented
+        return view(self.parent, self.query & other.query)
+
+    def __or__(self, other):
+        '''rows meeting either query. Call using (table[a]>x) | (table[b]==y)'''
+        if not self.__same_parent__(other):
+            return NotImplemented
+        return view(self.parent, self.query | other.query)
+
+    def __invert__(self):
+        '''rows not meeting the query. Call using ~(table[a]>x)'''
+        return view(self.parent, ~self.query)
 
 class SAVEPOINT(metaclass=SavepointMeta):
     def __matmul__(self, other:table):
@@ -544,7 +923,11 @@ class ROLLBACK(metaclass=RollbackMeta):
         try:
             data=other.rollback.data
             del other.rollback.data
+            other.__detach_views__()
             other.data=data
+            other.synced=False
+            other.cascaded={}
+            other.__reindex__()
         except:
             self.trace()
             raise metaclass.BDBException.TransactionError(f"Error Rolling back table {other.table_name}")
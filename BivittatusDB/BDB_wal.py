@@ -0,0 +1,148 @@
+#Database level write-ahead log (<database>/journal.wal).
+#Every table and metadata write is staged here first. When a batch commits, all of its
+#file writes are appended to the journal followed by a commit record, the journal is
+#fsynced once, and only then are the table files rewritten. If the process dies while the
+#table files are being written, Handler.use() replays the committed batch on startup.
+#Batches without a commit record never touched the table files and are dropped.
+#A batch left by an exception drops the writes staged inside it, nested batches included,
+#and reports the files it dropped through on_rollback so cached state about them can be reset.
+#
+#The journal only holds finished file contents, so encrypted tables stay encrypted in it.
+
+import metaclass
+try:
+    import os
+    import struct
+    import zlib
+    from contextlib import contextmanager
+except ImportError:
+    raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
+
+WRITE = 1
+REMOVE = 2
+COMMIT = 3
+
+# op, crc32 of name+payload, name length, payload length
+_RECORD = struct.Struct("<BIHQ")
+
+class WriteAheadLog:
+    def __init__(self, database: str) -> None:
+        self.database = database
+        self.path = os.path.join(database, "journal.wal")
+        self.pending = {} #file name -> new contents, or None to remove the file
+        self.depth = 0
+        self.on_rollback = None #called with the file names of staged writes that were dropped or failed
+        self.committed = [] #functions to call once the outermost batch has committed, see after_commit
+
+    def in_batch(self) -> bool:
+        return self.depth > 0
+
+    def stage(self, name: str, raw: bytes | None):
+        """Queue a full file write (or removal when raw is None) and commit it unless a batch is open."""
+        self.pending.pop(name, None) #keep the latest write last so it is applied in order
+        self.pending[name] = raw
+        if not self.in_batch():
+            self.commit()
+
+    def staged(self, name: str) -> bool:
+        return name in self.pending
+
+    def after_commit(self, function):
+        """Call function once the writes staged so far are committed, right away outside a batch.
+        It is forgotten if the batch it was registered in is dropped."""
+        if self.in_batch():
+            self.committed.append(function)
+        else:
+            function()
+
+    def _dropped(self, names):
+        if self.on_rollback is not None and names:
+            self.on_rollback(list(names))
+
+    @contextmanager
+    def batch(self):
+        """Group every staged write into one journal commit. Batches may be nested: an exception
+        leaving a nested batch drops its own writes, even if the exception is caught outside it."""
+        #a copy rather than a length, a write in this batch may replace an earlier write of the same file
+        saved, hooks = dict(self.pending), len(self.committed)
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            dropped = [name for name in self.pending if name not in saved or self.pending[name] is not saved[name]]
+            self.pending = saved
+            del self.committed[hooks:]
+            self._dropped(dropped)
+            raise
+        finally:
+            self.depth -= 1
+        if self.depth == 0:
+            hooks, self.committed = self.committed, []
+            self.commit()
+            for function in hooks:
+                function()
+
+    def _record(self, op: int, name: str, raw: bytes) -> bytes:
+        name = name.encode()
+        return _RECORD.pack(op, zlib.crc32(name + raw), len(name), len(raw)) + name + raw
+
+    def commit(self):
+        """Make the staged writes durable in the journal, then apply them to the table files."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            with open(self.path, "wb") as journal:
+                for name, raw in batch.items():
+                    journal.write(self._record(REMOVE if raw is None else WRITE, name, raw or b""))
+                journal.write(self._record(COMMIT, "", struct.pack("<I", len(batch))))
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._apply(batch)
+        except BaseException:
+            self._dropped(batch)
+            raise
+
+    def _apply(self, batch: dict):
+        for name, raw in batch.items():
+            path = os.path.join(self.database, name)
+            if raw is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            with open(path, "wb") as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+        os.remove(self.path) #checkpoint, every table file now holds the batch
+
+    def _read_batch(self) -> dict | None:
+        '''return the committed batch in the journal, or None if it was never committed'''
+        batch = {}
+        with open(self.path, "rb") as journal:
+            while True:
+                header = journal.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return None
+                op, crc, name_size, raw_size = _RECORD.unpack(header)
+                name = journal.read(name_size)
+                raw = journal.read(raw_size)
+                if len(raw) < raw_size or zlib.crc32(name + raw) != crc:
+                    return None
+                if op == COMMIT:
+                    return batch if struct.unpack("<I", raw)[0] == len(batch) else None
+                batch[name.decode()] = raw if op == WRITE else None
+
+    def recover(self) -> bool:
+        """Replay a committed batch left behind by a crash. Returns True if anything was replayed."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            batch = self._read_batch()
+        except Exception as e:
+            raise metaclass.BDBException.ReadError(f"Could not read journal {self.path}: {e}")
+        if batch is None:
+            os.remove(self.path)
+            return False
+        self._apply(batch)
+        return True
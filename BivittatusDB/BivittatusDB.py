@@ -12,14 +12,17 @@ except ImportError:
     raise metaclass.BDBException.ImportError(f"Could not import needed files in {__file__}")
 
 class Database:
-    def __init__(self, database_name: str, encrypt: bool = False):
+    def __init__(self, database_name: str, encrypt: bool | str = ENCRYPT_CACHED, key_type: str = KEY_RSA_4096):
+        """encrypt is one of ENCRYPT_NONE, ENCRYPT_AT_REST or ENCRYPT_CACHED (True/False map to cached/none).
+        key_type (KEY_RSA_4096, KEY_RSA_2048 or KEY_EC_P256) is used if the database has to generate its keys."""
         self.database_name = database_name
         self.encrypt = encrypt
+        self.key_type = key_type
         self.is_init = False  # Database initialization not yet performed
 
     def init(self):
         """Initialising and using the database."""
-        self.db = Handler(self.database_name, self.encrypt)  # Initialize the database only when explicitly called
+        self.db = Handler(self.database_name, self.encrypt, self.key_type)  # Initialize the database only when explicitly called
         self.db.init().use()
         self.is_init = True
         return self
@@ -27,11 +30,17 @@ class Database:
     def use(self):
         """Connect and use the existing database."""
         if not self.is_init:
-            self.db = Handler(self.database_name, self.encrypt)
+            self.db = Handler(self.database_name, self.encrypt, self.key_type)
             self.db.use()
             self.is_init = True
         return self
 
+    def batch(self):
+        """Group every save made inside the with block into one journaled commit."""
+        if not self.is_init:
+            raise metaclass.BDBException.CreationError("Database not initialized. Please initialize before saving data.")
+        return self.db.batch()
+
     def load_table(self, table_name: str):
         """Load an existing table from the database."""
         if not self.is_init:
@@ -44,8 +53,8 @@ class Database:
     def __call__(self, table_name: str) -> Any:
         return self.load_table(table_name)
 
-    def new_table(self, name: str, columns: tuple, data_types: tuple, primary: str = None, foreign: list = None):
-        """Create a new table in the database."""
+    def new_table(self, name: str, columns: tuple, data_types: tuple, primary: str = None, foreign: list = None, encrypt: bool = None):
+        """Create a new table in the database. encrypt overrides the database policy for this table."""
         if primary and primary not in columns:
             raise metaclass.BDBException.KeyError(f"Can't make unknown column {primary} into a primary key")
 
@@ -57,7 +66,7 @@ class Database:
         metadata.append(("Referenced By", ""))
 
         # Create table with the provided schema
-        self.db.CreateTable(name, [columns], metadata)
+        self.db.CreateTable(name, [columns], metadata, encrypt)
 
         # Configure foreign keys
         if foreign:
@@ -112,17 +121,15 @@ class Database:
 
         for table_name, table_data in data.items():
             tb = self.load_table(table_name)
-            types = tb.__load_metadata__()[1].column[:-3]
+            types = tb.__schema__().types
             default_values = table_data.get("def_val", None)
             
             for i, datatype in enumerate(types):
-                datatype = eval(datatype)
                 tableData = table_data["data"]
                 for row in tableData:
                     row[i] = datatype(row[i])
                     
-            for row in table_data["data"]:
-                tb += tuple(row)
+            tb.extend(tuple(row) for row in table_data["data"])
             tb.__save__()
 
 # Class to share tables
@@ -18,9 +18,13 @@ def metadata(table):
     '''returns the metadata of specified table as a table. Metadata table does not have metadata.'''
     return getattr(table, "__load_metadata__")()
 
-def scan(table):
-    '''scans a table for errors if updated manually'''
-    getattr(table, "__scan__")()
+def scan(table, report=False, workers=1):
+    '''scans a table for errors if updated manually. Raises the first kind of error found, or with
+    report=True returns a report of every violation (report.ok is True for a clean table).
+    workers > 1 checks the datatypes of large tables in that many forked processes'''
+    if report:
+        return getattr(table, "__scan__")(False, workers)
+    getattr(table, "__scan__")(True, workers)
     return True
 
 def drop(database:str):
@@ -58,6 +62,24 @@ ALL=None
 PRIMARY=None
 VERBOSE=OFF
 
+#Encryption policies for Database(name, encrypt=...) and Database.new_table(..., encrypt=...)
+ENCRYPT_NONE="none" #plain table files, no keys are generated
+ENCRYPT_AT_REST="at-rest" #encrypted files, the data key is unwrapped for every file access
+ENCRYPT_CACHED="at-rest-cached" #encrypted files, the data key is unwrapped once per session
+
+#Key pair types for Database(name, key_type=...), only used when a database generates its keys
+KEY_RSA_4096="rsa-4096" #default
+KEY_RSA_2048="rsa-2048" #faster to generate, still fine for short lived databases
+KEY_EC_P256="ec-p256" #elliptic curve key, generated in milliseconds
+
+#Join kinds for table.join(other, how)
+JOIN_INNER="inner" #pairs of matching rows
+JOIN_LEFT="left" #every left row, with its matches or None (table<<other)
+JOIN_RIGHT="right" #every right row, with its matches or None (table>>other)
+JOIN_SEMI="semi" #left rows that have a match
+JOIN_ANTI="anti" #left rows without a match
+JOIN_FULL="full" #every row of both tables, matched where possible (table^other)
+
 class infomessage():
     def __init__(self, message: str, **print_kwargs) -> None:
         if VERBOSE:
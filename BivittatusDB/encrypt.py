@@ -1,26 +1,82 @@
 import os
-from bdb_aggregate import infomessage
+import struct
+import shutil
+import threading
+from io import BytesIO
+from concurrent.futures import Future
+from bdb_aggregate import infomessage, KEY_RSA_4096
 from traceback import format_exc as trace
 from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ec
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.exceptions import InvalidKey
 
+_OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+_CURVES = {"p256": ec.SECP256R1, "p384": ec.SECP384R1}
+_WRAPPED_OVERHEAD = 12 + 16 #IV and GCM tag of an EC wrapped key
+
+def _point_size(curve) -> int:
+    # uncompressed X9.62 point
+    return 1 + 2 * ((curve.key_size + 7) // 8)
+
+def _derive(secret: bytes, point: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"BDB key wrap " + point,
+                backend=default_backend()).derive(secret)
+
+def wrap_key(public_key, key: bytes) -> bytes:
+    """Encrypt a symmetric key to a public key. RSA keys use OAEP, EC keys use ECDH with an ephemeral key."""
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        ephemeral = ec.generate_private_key(public_key.curve, default_backend())
+        point = ephemeral.public_key().public_bytes(serialization.Encoding.X962,
+                                                    serialization.PublicFormat.UncompressedPoint)
+        return point + RSAFileEncryptor.encrypt_bytes(_derive(ephemeral.exchange(ec.ECDH(), public_key), point), key)
+    return public_key.encrypt(key, _OAEP)
+
+def unwrap_key(private_key, wrapped: bytes) -> bytes:
+    """Decrypt a symmetric key produced by wrap_key."""
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        size = _point_size(private_key.curve)
+        point = wrapped[:size]
+        peer = ec.EllipticCurvePublicKey.from_encoded_point(private_key.curve, point)
+        return RSAFileEncryptor.decrypt_bytes(_derive(private_key.exchange(ec.ECDH(), peer), point), wrapped[size:])
+    return private_key.decrypt(wrapped, _OAEP)
+
+def wrapped_key_size(private_key, key_size: int = 32) -> int:
+    """Size of a key_size byte symmetric key once wrapped for this key pair."""
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return _point_size(private_key.curve) + _WRAPPED_OVERHEAD + key_size
+    return private_key.key_size // 8
+
+def key_type_of(private_key) -> str:
+    """Key type (see KeyManager) of a loaded private key."""
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        for name, curve in _CURVES.items():
+            if isinstance(private_key.curve, curve):
+                return f"ec-{name}"
+        raise ValueError(f"Unknown curve {private_key.curve.name}")
+    return f"rsa-{private_key.key_size}"
+
 class KeyManager:
-    def __init__(self, database, key_size=4096):
+    def __init__(self, database, key_size=4096, key_type=None):
         """
-        Initialize KeyManager with the path to the database and RSA key size.
+        Initialize KeyManager with the path to the database and key type.
+        Keys are checked (and generated if missing) on first use, not here.
         
         :param database: Path to the directory where keys are stored.
-        :param key_size: Size of the RSA key in bits (default is 4096).
+        :param key_size: Size of the RSA key in bits (default is 4096), used when key_type is not given.
+        :param key_type: "rsa-<bits>" or "ec-p256"/"ec-p384", only used when new keys are generated.
         """
         self.key_size = key_size
+        self.key_type = key_type or f"rsa-{key_size}"
         self.database = database
         self.private_key_file = os.path.join(self.database, "private.pem")
         self.public_key_file = os.path.join(self.database, "public.pem")
+        self.checked = False
+        self.pending = None #Future of a background key generation
+        self.lock = threading.Lock()
         self.ensure_database_exists()
-        self.key_checker()
 
     def ensure_database_exists(self):
         """Ensure that the database directory exists."""
@@ -33,14 +89,19 @@ class KeyManager:
                 infomessage(trace())
                 raise RuntimeError(f"Error creating database directory: {e}")
 
-    def generate_keys(self):
-        """Generate RSA key pair and save to files."""
+    def _new_private_key(self, key_type:str=None):
+        key_type = key_type or self.key_type
+        family, _, size = key_type.partition("-")
+        if family == "rsa" and size.isdigit():
+            return rsa.generate_private_key(public_exponent=65537, key_size=int(size), backend=default_backend())
+        if family == "ec" and size in _CURVES:
+            return ec.generate_private_key(_CURVES[size](), default_backend())
+        raise ValueError(f"Unknown key type {key_type}")
+
+    def generate_keys(self, private_key_file:str=None, public_key_file:str=None, key_type:str=None):
+        """Generate a key pair of the configured type (or key_type) and save to files, by default the database key files."""
         try:
-            key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=self.key_size,
-                backend=default_backend()
-            )
+            key = self._new_private_key(key_type)
             private_key = key.private_bytes(
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PrivateFormat.TraditionalOpenSSL,
@@ -50,11 +111,13 @@ class KeyManager:
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PublicFormat.SubjectPublicKeyInfo
             )
-            os.makedirs(os.path.dirname(self.private_key_file), exist_ok=True)
-            with open(self.private_key_file, "wb") as priv_file:
-                priv_file.write(private_key)
-            with open(self.public_key_file, "wb") as pub_file:
-                pub_file.write(public_key)
+            private_key_file = private_key_file or self.private_key_file
+            public_key_file = public_key_file or self.public_key_file
+            os.makedirs(os.path.dirname(private_key_file), exist_ok=True)
+            for path, pem in ((private_key_file, private_key), (public_key_file, public_key)):
+                with open(path + ".tmp", "wb") as key_file:
+                    key_file.write(pem)
+                os.replace(path + ".tmp", path) #never leave a half written key behind
             infomessage("Keys generated and saved successfully.")
         except IOError as e:
             infomessage(f"IOError during key generation: {e}")
@@ -98,22 +161,7 @@ class KeyManager:
 
         try:
             test_data = b"test"
-            encrypted_data = public_key.encrypt(
-                test_data,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-            decrypted_data = private_key.decrypt(
-                encrypted_data,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
+            decrypted_data = unwrap_key(private_key, wrap_key(public_key, test_data))
             if decrypted_data != test_data:
                 raise ValueError("Public and private keys do not match.")
         except (ValueError, TypeError) as e:
@@ -132,6 +180,7 @@ class KeyManager:
                 infomessage("Key files are missing. Generating new keys...")
                 self.generate_keys()
             self.verify_key_pair()
+            self.checked = True
             infomessage("Keys are valid and match.")
         except (FileNotFoundError, IOError, ValueError, TypeError) as e:
             infomessage(trace())
@@ -139,27 +188,134 @@ class KeyManager:
             infomessage("Regenerating keys...")
             self.generate_keys()  # Regenerate keys if validation fails
             self.verify_key_pair()  # Re-verify after regeneration
+            self.checked = True
         except Exception as e:
             infomessage(trace())
             infomessage(f"Unexpected error during key check: {e}")
             raise RuntimeError(f"Unexpected error during key check: {e}")
 
+    def ensure_keys(self):
+        """Make sure a valid key pair exists, waiting for a background generation if one is running."""
+        pending = self.pending
+        if pending is not None:
+            pending.result()
+        elif not self.checked:
+            with self.lock:
+                if not self.checked:
+                    self.key_checker()
+
+    def generate_async(self) -> Future:
+        """Check or generate the key pair in a background thread. ensure_keys waits for it to finish."""
+        with self.lock:
+            if self.pending is None:
+                self.pending = Future()
+                threading.Thread(target=self._generate_pending, name=f"keygen-{self.database}").start()
+            return self.pending
+
+    def _generate_pending(self):
+        try:
+            with self.lock:
+                if not self.checked:
+                    self.key_checker()
+            self.pending.set_result(True)
+        except BaseException as e:
+            self.pending.set_exception(e)
+
 class RSAFileEncryptor:
-    def __init__(self, database):
+    def __init__(self, database, key_type=None):
         """
         Initialize RSAFileEncryptor with the path to the database.
+        The key pair is only checked and loaded once it is first needed.
         
         :param database: Path to the directory where keys are stored.
+        :param key_type: Key type used if keys have to be generated (see KeyManager).
         """
-        self.key_manager = KeyManager(database)
-        self.public_key = self.key_manager.load_public_key()
-        self.private_key = self.key_manager.load_private_key()
+        self.key_manager = KeyManager(database, key_type=key_type or KEY_RSA_4096)
+        self._public_key = None
+        self._private_key = None
         self.database = database
 
+    @property
+    def public_key(self):
+        if self._public_key is None:
+            self.key_manager.ensure_keys()
+            self._public_key = self.key_manager.load_public_key()
+        return self._public_key
+
+    @public_key.setter
+    def public_key(self, key):
+        self._public_key = key
+
+    @property
+    def private_key(self):
+        if self._private_key is None:
+            self.key_manager.ensure_keys()
+            self._private_key = self.key_manager.load_private_key()
+        return self._private_key
+
+    @private_key.setter
+    def private_key(self, key):
+        self._private_key = key
+
     def generate_keys(self):
         """Delegate key generation to KeyManager."""
         self.key_manager.generate_keys()
 
+    def wrap_key(self, key: bytes) -> bytes:
+        """Encrypt a symmetric key with the public key."""
+        return wrap_key(self.public_key, key)
+
+    def unwrap_key(self, wrapped_key: bytes) -> bytes:
+        """Decrypt a symmetric key with the private key."""
+        return unwrap_key(self.private_key, wrapped_key)
+
+    @staticmethod
+    def encrypt_bytes(key: bytes, data: bytes) -> bytes:
+        """Encrypt data with AES-GCM under an already unwrapped key. Returns IV + tag + ciphertext."""
+        iv = os.urandom(12)
+        encryptor = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend()).encryptor()
+        encrypted_data = encryptor.update(data) + encryptor.finalize()
+        return iv + encryptor.tag + encrypted_data
+
+    @staticmethod
+    def decrypt_bytes(key: bytes, blob: bytes) -> bytes:
+        """Decrypt data produced by encrypt_bytes."""
+        iv, tag, encrypted_data = blob[:12], blob[12:28], blob[28:]
+        decryptor = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend()).decryptor()
+        return decryptor.update(encrypted_data) + decryptor.finalize()
+
+    def encrypt_data(self, file_data: bytes) -> bytes:
+        """Encrypt data in memory using RSA and AES. Returns IV + encrypted session key + tag + ciphertext."""
+        # Generate a symmetric AES key
+        session_key = os.urandom(32)
+
+        # Encrypt the session key with RSA
+        encrypted_session_key = self.wrap_key(session_key)
+
+        # Encrypt the file data with AES-GCM
+        iv = os.urandom(12)  # Recommended: 96 bits (12 bytes) for GCM
+        cipher = Cipher(algorithms.AES(session_key), modes.GCM(iv), backend=default_backend())
+        encryptor = cipher.encryptor()
+        encrypted_data = encryptor.update(file_data) + encryptor.finalize()
+        return iv + encrypted_session_key + encryptor.tag + encrypted_data  # GCM tag for authentication
+
+    def decrypt_data(self, raw: bytes) -> bytes:
+        """Decrypt data produced by encrypt_data in memory."""
+        # Split encrypted session key, IV, tag, and encrypted data
+        key_size = wrapped_key_size(self.private_key)
+        iv = raw[:12]  # 12 bytes for IV in GCM
+        encrypted_session_key = raw[12:12 + key_size]
+        tag = raw[12 + key_size:28 + key_size]  # 16 bytes for tag in GCM
+        encrypted_data = raw[28 + key_size:]
+
+        # Decrypt the session key with RSA
+        session_key = self.unwrap_key(encrypted_session_key)
+
+        # Decrypt the file data with AES-GCM
+        cipher = Cipher(algorithms.AES(session_key), modes.GCM(iv, tag), backend=default_backend())
+        decryptor = cipher.decryptor()
+        return decryptor.update(encrypted_data) + decryptor.finalize()
+
     def encrypt_file(self, input_file, output_file:str=None):
         """Encrypt a file using RSA and AES."""
         if not os.path.exists(input_file):
@@ -168,33 +324,12 @@ class RSAFileEncryptor:
             raise ValueError(f"The file {input_file} is empty.")
 
         try:
-            # Generate a symmetric AES key
-            session_key = os.urandom(32)
-
-            # Encrypt the session key with RSA
-            encrypted_session_key = self.public_key.encrypt(
-                session_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-
-            # Encrypt the file data with AES-GCM
             with open(input_file, "rb") as f:
                 file_data = f.read()
-
-            iv = os.urandom(12)  # Recommended: 96 bits (12 bytes) for GCM
-            cipher = Cipher(algorithms.AES(session_key), modes.GCM(iv), backend=default_backend())
-            encryptor = cipher.encryptor()
-            encrypted_data = encryptor.update(file_data) + encryptor.finalize()
+            encrypted_data = self.encrypt_data(file_data)
             output_file = output_file or input_file
             # Save the encrypted session key, IV, tag, and encrypted data
             with open(output_file, "wb") as f:
-                f.write(iv)
-                f.write(encrypted_session_key)
-                f.write(encryptor.tag)  # GCM tag for authentication
                 f.write(encrypted_data)
             infomessage("File encrypted successfully.")
         except (IOError, ValueError) as e:
@@ -214,28 +349,8 @@ class RSAFileEncryptor:
             raise ValueError(f"The file {input_file} is empty.")
 
         try:
-
-            # Read encrypted session key, IV, tag, and encrypted data
             with open(input_file, "rb") as f:
-                iv = f.read(12)  # 12 bytes for IV in GCM
-                encrypted_session_key = f.read(self.private_key.key_size // 8)
-                tag = f.read(16)  # 16 bytes for tag in GCM
-                encrypted_data = f.read()
-
-            # Decrypt the session key with RSA
-            session_key = self.private_key.decrypt(
-                encrypted_session_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-
-            # Decrypt the file data with AES-GCM
-            cipher = Cipher(algorithms.AES(session_key), modes.GCM(iv, tag), backend=default_backend())
-            decryptor = cipher.decryptor()
-            decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
+                decrypted_data = self.decrypt_data(f.read())
 
             # Save the decrypted data back to the file
             with open(input_file, "wb") as f:
@@ -250,6 +365,228 @@ class RSAFileEncryptor:
             infomessage(trace())
             raise RuntimeError(f"Unexpected error during file decryption: {e}")
 
+class EnvelopeEncryptor:
+    MAGIC = b"BDBE" #one AES-GCM message per file
+    CHUNKED = b"BDBC" #fixed size segments, each with its own nonce and tag
+    VERSION = 2 #version 1 files use the data key directly, version 2 files have their own file key
+    SEGMENT_SIZE = 64 * 1024
+    # magic, version, segment size, nonce prefix, plaintext length
+    HEADER = struct.Struct("<4sBI8sQ")
+    # key slot of version 2 files, follows the header: slot type, wrapped file key length
+    KEY_SLOT = struct.Struct("<BH")
+    SLOT_DATA_KEY = 0 #file key wrapped with the database data key
+    SLOT_PUBLIC_KEY = 1 #file key wrapped for a public key, used by exported tables
+    TAG_SIZE = 16
+
+    def __init__(self, rsa: RSAFileEncryptor, database, cache: bool = True, key_type: str = None):
+        """
+        Encrypt table files with one AES data key per database. The data key is stored
+        wrapped by the RSA key pair and, when cached, only unwrapped once per session.
+
+        :param rsa: RSAFileEncryptor holding the database key pair, or None to load it on first use.
+        :param database: Path to the directory where keys are stored.
+        :param cache: Keep the unwrapped data key in memory between file accesses.
+        :param key_type: Key type for a key pair created by this encryptor (see KeyManager).
+        """
+        self._rsa = rsa
+        self.key_type = key_type
+        self.database = database
+        self.cache = cache
+        self.key_file = os.path.join(database, "data.key")
+        self.data_key = None
+
+    @property
+    def rsa(self) -> RSAFileEncryptor:
+        if self._rsa is None:
+            self._rsa = RSAFileEncryptor(self.database, self.key_type)
+        return self._rsa
+
+    def load_key(self) -> bytes:
+        """Return the unwrapped data key, creating it the first time the database encrypts anything."""
+        if self.data_key is not None:
+            return self.data_key
+        if os.path.exists(self.key_file):
+            with open(self.key_file, "rb") as f:
+                key = self.rsa.unwrap_key(f.read())
+        else:
+            key = os.urandom(32)
+            self.save_key(key)
+        if self.cache:
+            self.data_key = key
+        return key
+
+    def save_key(self, key: bytes):
+        """Wrap a data key with the current public key and make it the database data key."""
+        temp_file = self.key_file + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(self.rsa.wrap_key(key))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.key_file)
+        self.data_key = key if self.cache else None
+
+    @classmethod
+    def _segment_cipher(cls, key: bytes, header: bytes, index: int, tag: bytes = None):
+        # the nonce is the random per file prefix plus the segment number, the header is
+        # authenticated with every segment so segments can't be moved, dropped or reordered
+        nonce = header[9:17] + struct.pack(">I", index)
+        cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
+        context = cipher.decryptor() if tag else cipher.encryptor()
+        context.authenticate_additional_data(header)
+        return context
+
+    def key_slot(self, file_key: bytes, key: bytes = None, public_key=None) -> bytes:
+        """Wrap a file key with the data key, or for public_key when given."""
+        if public_key is None:
+            slot, wrapped = self.SLOT_DATA_KEY, RSAFileEncryptor.encrypt_bytes(key or self.load_key(), file_key)
+        else:
+            slot, wrapped = self.SLOT_PUBLIC_KEY, wrap_key(public_key, file_key)
+        return self.KEY_SLOT.pack(slot, len(wrapped)) + wrapped
+
+    def read_slot(self, f) -> tuple:
+        """Return (header, slot type, wrapped file key) of a chunked file and leave f at its first segment.
+        The slot type is None for files without a key slot."""
+        f.seek(0)
+        header = f.read(self.HEADER.size)
+        if header[:len(self.CHUNKED)] != self.CHUNKED:
+            raise ValueError("Not a chunked encrypted file")
+        if header[4] < 2:
+            return header, None, None
+        slot, size = self.KEY_SLOT.unpack(f.read(self.KEY_SLOT.size))
+        return header, slot, f.read(size)
+
+    def file_key(self, slot: int, wrapped: bytes, key: bytes = None, private_key=None) -> bytes:
+        """Unwrap the file key held in a key slot."""
+        if slot == self.SLOT_DATA_KEY:
+            return RSAFileEncryptor.decrypt_bytes(key or self.load_key(), wrapped)
+        if slot == self.SLOT_PUBLIC_KEY:
+            return unwrap_key(private_key or self.rsa.private_key, wrapped)
+        raise ValueError(f"Unknown key slot {slot}")
+
+    def rewrap(self, source, destination, key: bytes = None, private_key=None,
+               new_key: bytes = None, public_key=None) -> bool:
+        """Copy a chunked file with its file key wrapped for another key, without decrypting any segment.
+        key/private_key open the current slot, new_key/public_key make the new one (default: the data key).
+        Returns False for files without a key slot, which have to be re-encrypted instead."""
+        header, slot, wrapped = self.read_slot(source)
+        if slot is None:
+            return False
+        file_key = self.file_key(slot, wrapped, key, private_key)
+        destination.write(header + self.key_slot(file_key, new_key, public_key))
+        shutil.copyfileobj(source, destination, 1 << 20)
+        return True
+
+    def encrypt_segments(self, chunks, size: int, write, key: bytes = None, public_key=None):
+        """Stream plaintext chunks of a known total size into the chunked format through write().
+        Every file gets a fresh file key, wrapped with the data key (or key), or for public_key."""
+        file_key = os.urandom(32)
+        header = self.HEADER.pack(self.CHUNKED, self.VERSION, self.SEGMENT_SIZE, os.urandom(8), size)
+        write(header + self.key_slot(file_key, key, public_key))
+        key = file_key
+        index, pending = 0, b"" #pending: start of the next segment, left over from the previous chunk
+        for chunk in chunks:
+            view, offset = memoryview(chunk), 0
+            if pending:
+                offset = self.SEGMENT_SIZE - len(pending)
+                pending += view[:offset]
+                if len(pending) < self.SEGMENT_SIZE:
+                    continue
+                write(self._seal(key, header, index, pending))
+                index += 1
+            while len(view) - offset >= self.SEGMENT_SIZE:
+                write(self._seal(key, header, index, view[offset:offset + self.SEGMENT_SIZE]))
+                offset += self.SEGMENT_SIZE
+                index += 1
+            pending = bytes(view[offset:])
+        if pending:
+            write(self._seal(key, header, index, pending))
+
+    def _seal(self, key: bytes, header: bytes, index: int, segment) -> bytes:
+        encryptor = self._segment_cipher(key, header, index)
+        return encryptor.update(segment) + encryptor.finalize() + encryptor.tag
+
+    def encrypt_data(self, data: bytes, key: bytes = None, public_key=None) -> bytes:
+        """Encrypt data in the chunked format."""
+        out = bytearray()
+        self.encrypt_segments([data], len(data), out.extend, key, public_key)
+        return bytes(out)
+
+    def open(self, f, key: bytes = None, private_key=None) -> "SegmentReader":
+        """Random access to an encrypted file object."""
+        return SegmentReader(self, f, key, private_key)
+
+    def decrypt_data(self, raw: bytes, key: bytes = None, private_key=None) -> bytes:
+        """Decrypt data, falling back to the single message and per-file RSA formats of older files."""
+        if raw[:len(self.CHUNKED)] == self.CHUNKED:
+            return b"".join(self.open(BytesIO(raw), key, private_key).chunks())
+        if raw[:len(self.MAGIC)] == self.MAGIC:
+            return self.rsa.decrypt_bytes(key or self.load_key(), raw[len(self.MAGIC):])
+        return self.rsa.decrypt_data(raw)
+
+class SegmentReader:
+    def __init__(self, envelope: EnvelopeEncryptor, f, key: bytes = None, private_key=None):
+        """
+        Read ranges of an encrypted file, decrypting only the segments a read touches.
+        Files in the older whole-file formats are decrypted once up front.
+
+        :param envelope: EnvelopeEncryptor the file was written with.
+        :param f: Seekable binary file object.
+        :param key: Unwrapped data key (default: the database data key).
+        :param private_key: Private key for files whose key slot is wrapped for a public key.
+        """
+        self.envelope = envelope
+        self.f = f
+        self.last = (None, b"") #most recently decrypted segment
+        f.seek(0)
+        self.header = f.read(envelope.HEADER.size)
+        if self.header[:len(envelope.CHUNKED)] == envelope.CHUNKED:
+            _, _, self.segment_size, _, self.size = envelope.HEADER.unpack(self.header)
+            self.plain = None
+            _, slot, wrapped = envelope.read_slot(f)
+            if slot is None:
+                self.key = key or envelope.load_key()
+            else:
+                self.key = envelope.file_key(slot, wrapped, key, private_key)
+            self.offset = f.tell()
+        else:
+            f.seek(0)
+            self.plain = envelope.decrypt_data(f.read(), key)
+            self.size = len(self.plain)
+
+    def _segment(self, index: int) -> bytes:
+        if self.last[0] == index:
+            return self.last[1]
+        envelope = self.envelope
+        length = min(self.segment_size, self.size - index * self.segment_size)
+        self.f.seek(self.offset + index * (self.segment_size + envelope.TAG_SIZE))
+        encrypted = self.f.read(length + envelope.TAG_SIZE)
+        if len(encrypted) != length + envelope.TAG_SIZE:
+            raise ValueError("Encrypted file is truncated")
+        decryptor = envelope._segment_cipher(self.key, self.header, index, encrypted[length:])
+        segment = decryptor.update(encrypted[:length]) + decryptor.finalize()
+        self.last = (index, segment)
+        return segment
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Return size bytes of plaintext starting at offset."""
+        size = max(0, min(size, self.size - offset))
+        if self.plain is not None:
+            return self.plain[offset:offset + size]
+        if size == 0:
+            return b""
+        first, last = offset // self.segment_size, (offset + size - 1) // self.segment_size
+        data = b"".join(self._segment(index) for index in range(first, last + 1))
+        start = offset - first * self.segment_size
+        return data[start:start + size]
+
+    def chunks(self):
+        """Yield the whole plaintext one segment at a time."""
+        if self.plain is not None:
+            yield self.plain
+            return
+        for index in range((self.size + self.segment_size - 1) // self.segment_size):
+            yield self._segment(index)
+
 # Example usage
 if __name__ == "__main__":
     database = "bivittatusDB/test"  # Database path
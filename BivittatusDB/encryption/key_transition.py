@@ -1,43 +1,220 @@
 import os
-from encrypt import RSAFileEncryptor
+import json
+import metaclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cryptography.exceptions import InvalidTag
+from encrypt import RSAFileEncryptor, EnvelopeEncryptor, unwrap_key, wrap_key, key_type_of
+from BDB_log import TableLog
+from BDB_io import Handler
+from BDB_wal import WriteAheadLog
+import BDB_format
+import BDB_index
 
 class KeyTransition:
     def __init__(self, database:str) -> None:
         self.path=database
         self.rsa=RSAFileEncryptor(self.path)
+        self.envelope=EnvelopeEncryptor(self.rsa, self.path)
+        self.state_file=f"{self.path}/rekey.state"
+        self.new_priv=f"{self.path}/private.pem.new"
+        self.new_pub=f"{self.path}/public.pem.new"
 
     def __copy_pubKey__(self):
         with open(f"{self.path}/private.pem", "rb") as original:
-            with open(f"{self.path}/key.priv", "wb") as copy:
+            with open(f"{self.path}/key.priv.tmp", "wb") as copy:
                 copy.write(original.read())
+                copy.flush()
+                os.fsync(copy.fileno())
+        os.replace(f"{self.path}/key.priv.tmp", f"{self.path}/key.priv")
 
-    def ReKey(self, regen:bool=False):
-        #used to generate new keys for a database
-        if regen==True:
+    def __stage_keys__(self):
+        #the new pair, of the same type as the current one, is written beside it and only installed once
+        #the state is saved, so a ReKey interrupted before that never touched private.pem or key.priv
+        self.rsa.key_manager.generate_keys(self.new_priv, self.new_pub, key_type_of(self.rsa.private_key))
+        return self.rsa.key_manager.load_public_key(self.new_pub)
+
+    def __install_keys__(self):
+        #while the new private key is staged, private.pem still holds the old one and may be kept as key.priv,
+        #so this can be repeated by a resumed ReKey until the new pair is in place
+        if os.path.exists(self.new_priv):
             self.__copy_pubKey__()
-            self.rsa.generate_keys()
+            os.replace(self.new_priv, f"{self.path}/private.pem")
+        if os.path.exists(self.new_pub):
+            os.replace(self.new_pub, f"{self.path}/public.pem")
+        self.rsa.private_key=None
+        self.rsa.public_key=None
+
+    def __recrypt__(self, source:str, destination:str, decrypt, encrypt):
+        #decrypt and re-encrypt in memory, plaintext never touches the disk
+        with open(source, "rb") as f:
+            data=decrypt(f.read())
+        with open(destination, "wb") as f:
+            f.write(encrypt(data))
+
+    def __is_plain__(self, path:str)->bool:
+        #tables created without encryption are left as they are
+        with open(path, "rb") as f:
+            return f.read(len(BDB_format.MAGIC)) in (BDB_format.MAGIC, BDB_index.MAGIC)
+
+    def __decrypt__(self, raw:bytes)->bytes:
+        if raw[:len(BDB_format.MAGIC)]==BDB_format.MAGIC:
+            return raw
+        return self.envelope.decrypt_data(raw)
+
+    def __restream__(self, path:str, old_key:bytes, new_key:bytes):
+        #files with their own file key only need their key slot rewrapped, older formats are
+        #re-encrypted one segment at a time, so large tables are rekeyed in bounded memory
+        if self.__is_plain__(path):
+            return
+        with open(path, "r+b") as f:
+            chunked=f.read(len(self.envelope.CHUNKED))==self.envelope.CHUNKED
+            header, slot, wrapped=self.envelope.read_slot(f) if chunked else (None, None, None)
+            if slot==self.envelope.SLOT_DATA_KEY:
+                #a data key slot always has the same size, so it is rewritten in place
+                file_key=self.envelope.file_key(slot, wrapped, old_key)
+                f.seek(0)
+                f.write(header+self.envelope.key_slot(file_key, new_key))
+                f.flush()
+                os.fsync(f.fileno())
+                return
+        with open(path, "rb") as source, open(path+".tmp", "wb") as destination:
+            reader=self.envelope.open(source, old_key)
+            self.envelope.encrypt_segments(reader.chunks(), reader.size, destination.write, new_key)
+        os.replace(path+".tmp", path)
+
+    def __rekey_file__(self, path:str, old_key:bytes, new_key:bytes):
+        try:
+            if path.endswith(".pydl"):
+                TableLog(path, self.envelope).recrypt(new_key, old_key)
+            else:
+                self.__restream__(path, old_key, new_key)
+        except InvalidTag:
+            #an interrupted ReKey may have replaced the file before it could record it
+            if path.endswith(".pydl"):
+                log=TableLog(path, self.envelope)
+                log.key=new_key
+                list(log.records())
+            else:
+                with open(path, "rb") as f:
+                    next(self.envelope.open(f, new_key).chunks(), None)
+
+    def __save_state__(self, state:dict):
+        with open(self.state_file+".tmp", "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.state_file+".tmp", self.state_file)
+
+    def __start__(self, regen:bool)->tuple:
+        old_key=self.envelope.load_key()
+        public_key=self.__stage_keys__() if regen==True else self.rsa.public_key
+        #the new data key is kept wrapped in the checkpoint, so an interrupted ReKey can be resumed
+        new_key=os.urandom(32)
+        state={"regen": regen, "key": wrap_key(public_key, new_key).hex(), "done": []}
+        self.__save_state__(state)
+        if regen==True:
+            self.__install_keys__()
+        self.envelope.data_key=old_key
+        return state, new_key
+
+    def __old_key__(self)->bytes:
+        if self.envelope.data_key is not None:
+            return self.envelope.data_key
+        with open(self.envelope.key_file, "rb") as f:
+            return unwrap_key(self.rsa.private_key, f.read())
+
+    def ReKey(self, regen:bool=False, workers:int=None, progress=None):
+        """used to generate new keys for a database. Every table is re-encrypted under a new data key.
+        Files are rekeyed by a pool of worker threads. progress(done, total, file) is called after each
+        file, and finished files are checkpointed in rekey.state: if ReKey fails or is interrupted,
+        calling it again resumes with the same new key and only rekeys the remaining files."""
+        WriteAheadLog(self.path).recover() #the journal holds files under the old key
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state=json.load(f)
+            if state["regen"]:
+                self.__install_keys__() #the state may have been saved before the new keys were installed
+            self.envelope.data_key=None
+            new_key=self.rsa.unwrap_key(bytes.fromhex(state["key"]))
+        else:
+            state, new_key=self.__start__(regen)
+        if state["regen"]:
             self.priv_key=f"{self.path}/key.priv"
             self.rsa.private_key=self.rsa.key_manager.load_private_key(self.priv_key)
-            self.rsa.public_key=self.rsa.key_manager.load_public_key()
-        for file in os.listdir(self.path):
-            if ".pydb" in file:
-                self.rsa.decrypt_file(self.path+"/"+file)
-                self.rsa.encrypt_file(self.path+"/"+file)
-        self.rsa.private_key=self.rsa.key_manager.load_private_key()
-    
+        done=set(state["done"])
+        files=sorted(file for file in os.listdir(self.path)
+                     if file.endswith((".pydb", ".pydl", ".pydx")) and file not in done)
+        total=len(done)+len(files)
+        failed=[]
+        if files:
+            old_key=self.__old_key__()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                tasks={pool.submit(self.__rekey_file__, f"{self.path}/{file}", old_key, new_key): file for file in files}
+                for task in as_completed(tasks):
+                    file=tasks[task]
+                    if task.exception() is not None:
+                        failed.append((file, task.exception()))
+                        continue
+                    state["done"].append(file)
+                    self.__save_state__(state)
+                    if progress is not None:
+                        progress(len(state["done"]), total, file)
+        if state["regen"]:
+            self.rsa.private_key=self.rsa.key_manager.load_private_key()
+        if failed:
+            self.envelope.data_key=None
+            raise metaclass.BDBException.EncryptionError(
+                f"ReKey failed for {', '.join(file for file, _ in failed)} ({failed[0][1]!r}), "
+                f"{len(state['done'])} of {total} files are under the new key. Run ReKey again to resume.")
+        self.envelope.save_key(new_key)
+        os.remove(self.state_file)
+
     def export_table(self, table_name:str, export_key:str):
         "re-encrypt a table with a given public key, so that you don't need to share your private key"
-        self.rsa.public_key=self.rsa.key_manager.load_public_key(export_key)
-        self.rsa.decrypt_file(f"{self.path}/{table_name}.pydb")
+        public_key=self.rsa.key_manager.load_public_key(export_key)
+        source=f"{self.path}/{table_name}.pydb"
+        destination=f"{self.path}_export/{table_name}.pydb"
         os.makedirs(f"{self.path}_export", exist_ok=True)
-        self.rsa.encrypt_file(f"{self.path}/{table_name}.pydb", f"{self.path}_export/{table_name}.pydb")
-        self.rsa.public_key=self.rsa.key_manager.load_public_key()
-        self.rsa.encrypt_file(f"{self.path}/{table_name}.pydb")
+        if not os.path.exists(f"{self.path}/{table_name}.pydl"):
+            #only the file key is rewrapped for the export key, the table data is copied as it is
+            with open(source, "rb") as f, open(destination+".tmp", "wb") as out:
+                done=not self.__is_plain__(source) and self.envelope.rewrap(f, out, public_key=public_key)
+            if done:
+                os.replace(destination+".tmp", destination)
+                return
+            os.remove(destination+".tmp")
+            with open(source, "rb") as f:
+                raw=self.__decrypt__(f.read())
+        else:
+            #export the logged changes too, without folding them into the original table
+            handler=Handler(self.path)
+            raw=BDB_format.encode_table(handler.ReadTable(table_name), handler.ReadMetadata(table_name))
+        with open(destination, "wb") as f:
+            f.write(self.envelope.encrypt_data(raw, public_key=public_key))
 
     def import_table(self, table_path:str, import_key:str):
         'import a table that has been shared with you via Share.export_table, if you are the private key holder'
         _, filename = os.path.split(table_path)
-        self.rsa.private_key=self.rsa.key_manager.load_private_key(import_key)
-        self.rsa.decrypt_file(table_path)
-        self.rsa.encrypt_file(table_path, f"{self.path}/{filename}")
-        self.rsa.private_key=self.rsa.key_manager.load_private_key()
+        destination=f"{self.path}/{filename}"
+        private_key=self.rsa.key_manager.load_private_key(import_key)
+        self.envelope.load_key()
+        with open(table_path, "rb") as f:
+            chunked=f.read(len(self.envelope.CHUNKED))==self.envelope.CHUNKED
+            with open(destination+".tmp", "wb") as out:
+                if chunked and self.envelope.rewrap(f, out, private_key=private_key):
+                    pass #only the file key is rewrapped for this database
+                elif chunked:
+                    raise metaclass.BDBException.EncryptionError(f"{table_path} was not exported with Share.export_table")
+                else:
+                    #tables exported before file keys were used are re-encrypted
+                    f.seek(0)
+                    self.rsa.private_key=private_key
+                    try:
+                        out.write(self.envelope.encrypt_data(self.rsa.decrypt_data(f.read())))
+                    finally:
+                        self.rsa.private_key=None
+        os.replace(destination+".tmp", destination)
+        for stale in (".pydl", ".pydx"): #changes logged against and indexes built for the table that was replaced
+            path=destination[:-len(".pydb")]+stale
+            if os.path.exists(path):
+                os.remove(path)
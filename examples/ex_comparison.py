@@ -25,4 +25,21 @@ print(tb1["id"]>2)
 print(tb1["id"]<=2)
 print(tb1["id"]>=2)
 print(tb1["id"]==2)
-print(tb1["id"]!=2)
\ No newline at end of file
+print(tb1["id"]!=2)
+#combine comparisons with & (and), | (or) and ~ (not)
+print((tb1["id"]>1) & (tb1["name"]!="Cindy"))
+print((tb1["id"]==1) | (tb1["name"]=="Cindy"))
+print(~(tb1["id"]==2))
+
+#None never meets <, <=, > or >=, so ~ keeps those rows, with or without an index on the column
+tb2=test_db.new_table("table2", 
+                       ("id", "age"), 
+                       (int, int), 
+                       "id")
+tb2+(1, 10)
+tb2+(2, None)
+tb2+(3, 40)
+scanned=(~(tb2["age"]>30)).data
+tb2.create_index("age")
+assert (~(tb2["age"]>30)).data==scanned
+print(~(tb2["age"]>30))
@@ -24,4 +24,9 @@ print(tb1)
 #remove all rows that hold the value "Bob" in column "name"
 tb1["name"]-"Bob"
 
-print(tb1)
\ No newline at end of file
+print(tb1)
+
+#remove all rows meeting a comparison (or a combined query), returns the number of rows removed
+print(tb1-(tb1["id"]>2))
+
+print(tb1)
@@ -27,4 +27,5 @@ setup(
     ],
     python_requires='>=3.6',
     install_requires=["cryptography==42.0.8"],
+    extras_require={"numpy": ["numpy"]},  # vectorized comparisons on numeric columns
 )